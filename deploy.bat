@@ -4,11 +4,23 @@ for /F %%i in ('ampy ls') do (
     echo Deleting %%i
     ampy rm %%i
 )
+rem Modules are precompiled to bytecode so the Pico doesn't have to parse them on every boot, which saves both boot time
+rem and the RAM the parser would otherwise need (mpy-cross must match the firmware's MicroPython version, see
+rem requirements.txt). main.py is the exception, since MicroPython only runs main.py itself on boot.
+rem -O3 strips out asserts and __debug__ blocks.
+set BUILD_DIR=%TEMP%\knob_build
+if not exist "%BUILD_DIR%" mkdir "%BUILD_DIR%"
 for %%d in (.\\src\\main\\common, .\\src\\main\\device, .\\lib\\device) do (
     pushd %%d
     for /R %%f in (*.py) do (
-        echo Writing %%f
-        ampy put "%%f" "%%~nxf"
+        if /I "%%~nxf"=="main.py" (
+            echo Writing %%f
+            ampy put "%%f" "%%~nxf"
+        ) else (
+            echo Compiling %%f
+            mpy-cross -march=armv6m -O3 -o "%BUILD_DIR%\%%~nf.mpy" "%%f" || exit /b 1
+            ampy put "%BUILD_DIR%\%%~nf.mpy" "%%~nf.mpy"
+        )
     )
     popd
 )
@@ -4,42 +4,60 @@ Constants
 File containing various global constants used by the host software, device software or both.
 """
 
+# Integer constants are declared with const() so MicroPython can substitute the value directly into the bytecode
+# wherever it's used within a module, rather than looking it up as a global every time. Note that this only applies
+# to the module the const() is in (imported constants are still globals), so device modules that use a constant in
+# a hot loop should still bind it to a local. CPython has no such thing, so there it's just the identity function.
+try:
+    from micropython import const
+except ImportError:
+    const = lambda x: x
+
 # Serial comms
 CACHE_FILENAME = "serial.cache"     # Name of the file containing cached connection info
-BAUD_RATE = 115200                  # Baud rate for the serial communication
+BAUD_RATE = const(921600)           # Baud rate for the serial communication (see note below)
 COM_PORT = "auto"                   # COM port that the device is connected to, or "auto" to identify automatically
-USB_VID = 11914                     # USB vendor ID for Raspberry Pi
-USB_PID = 5                         # USB product ID for Pico running MicroPython firmware
-DEVICE_TYPE_ID = 100                # Unique device identifier for volume knob devices to distinguish them from other Picos
-BROADCAST_INTERVAL = 1000           # Time between sending device ID messages, in ms (must be less than connection timeout)
-CONNECTION_TIMEOUT = 2              # Serial connection timeout, in seconds
-RECONNECT_DELAY = 5                 # Time between connection attempts, in seconds
+USB_VID = const(11914)              # USB vendor ID for Raspberry Pi
+USB_PID = const(5)                  # USB product ID for Pico running MicroPython firmware
+DEVICE_TYPE_ID = const(100)         # Unique device identifier for volume knob devices to distinguish them from other Picos
+BROADCAST_INTERVAL = const(1000)    # Time between sending device ID messages, in ms (must be less than connection timeout)
+CONNECTION_TIMEOUT = const(2)       # Serial connection timeout, in seconds
+RECONNECT_DELAY = const(5)          # Time between connection attempts, in seconds
+MAX_MESSAGES_PER_UPDATE = const(4)  # Maximum number of messages to handle per serial manager update (the rest wait until next time)
 SPACE_ASCII = int(" ".encode("utf-8")[0])
 
+# Note on serial latency: the Pico talks to the host over USB CDC, which ignores the baud rate entirely, so the value
+# above only matters if a real UART (or USB-UART bridge) is ever put in the path - in which case a higher rate means
+# less time on the wire per message. What does affect latency on the host end is the driver's receive buffering: on
+# Linux the host serial manager requests ASYNC_LOW_LATENCY (the TIOCGSERIAL/TIOCSSERIAL ioctls, equivalent to
+# `setserial <port> low_latency`) when connecting. On Windows the equivalent is the driver's latency timer setting
+# (for FTDI-style adapters) together with SetCommTimeouts, which pyserial configures from the timeouts below.
+
 # Logging
-TRACE = 5
+TRACE = const(5)
 LOGS_DIRECTORY = "logs"
 PRIMARY_LOG_FILENAME = "latest.log"
 DEBUG_LOG_FILENAME = "debug.log"
 
 # Pin number assignments for the Raspberry Pi Pico
-ONBOARD_LED_PIN = 25                # Pin number used for the onboard LED on the Raspberry Pi Pico
-PIXEL_DATA_PIN = 28                 # Pin number connected to the neopixel data in line
-ENCODER_A_PIN = 22                  # Pin number connected to encoder output A
-ENCODER_B_PIN = 21                  # Pin number connected to encoder output B
-ENCODER_SW_PIN = 18                 # Pin number connected to the encoder switch output
+ONBOARD_LED_PIN = const(25)         # Pin number used for the onboard LED on the Raspberry Pi Pico
+PIXEL_DATA_PIN = const(28)          # Pin number connected to the neopixel data in line
+ENCODER_A_PIN = const(22)           # Pin number connected to encoder output A
+ENCODER_B_PIN = const(21)           # Pin number connected to encoder output B
+ENCODER_SW_PIN = const(18)          # Pin number connected to the encoder switch output
 
 # Encoder
-ENCODER_PPR = 20                    # Encoder pulses per revolution (1 pulse = 4 counts)
-ENCODER_DEADZONE = 3                # Rotations of fewer than this many encoder counts will be ignored (80 = 1 rev.)
+ENCODER_PPR = const(20)             # Encoder pulses per revolution (1 pulse = 4 counts)
+ENCODER_DEADZONE = const(3)         # Rotations of fewer than this many encoder counts will be ignored (80 = 1 rev.)
 
 # Neopixel ring
-PIXEL_COUNT = 24                    # Number of LEDs in the neopixel ring
-PIXEL_OFFSET = 20                   # Index of the first pixel clockwise from the back of the device (the one over the USB is last)
+PIXEL_COUNT = const(24)             # Number of LEDs in the neopixel ring
+PIXEL_OFFSET = const(20)            # Index of the first pixel clockwise from the back of the device (the one over the USB is last)
+PIXEL_DITHERING = False             # Whether to dither the pixel colours to smooth out fades at low brightness
 
 # Controls
-VOL_DISPLAY_HOLD_TIME = 2000        # Time in ms after the knob stops turning that the volume will continue being displayed
-LIKE_HOLD_TIME = 1500               # Time in ms that the button must be held for in order to like/unlike a song
+VOL_DISPLAY_HOLD_TIME = const(2000) # Time in ms after the knob stops turning that the volume will continue being displayed
+LIKE_HOLD_TIME = const(1500)        # Time in ms that the button must be held for in order to like/unlike a song
 
 # Colours
 STARTUP_COLOUR = (0, 0, 220)        # Colour of the LED animation during startup
@@ -49,21 +67,26 @@ LIKE_COLOUR = (120, 219, 255)       # Colour of the LED flash effect when liking
 UNLIKE_COLOUR = (120, 219, 200)     # Colour of the LED effect when un-liking the current song
 
 # Animations
-LED_TRANSITION_DURATION = 350       # Duration of LED transition effects, in ms
-LED_ANIMATION_DURATION = 600        # Duration of LED animation effects (like, play/pause, etc.), in ms
+LED_TRANSITION_DURATION = const(350) # Duration of LED transition effects, in ms
+LED_ANIMATION_DURATION = const(600) # Duration of LED animation effects (like, play/pause, etc.), in ms
+LED_REFRESH_INTERVAL = const(20)    # Time between LED ring refreshes, in ms (the rest of the main loop runs as fast as it can)
 AUDIO_VISUALISER_BRIGHTNESS = 0.7   # Normalised brightness of the audio visualiser animation
-STARTUP_ANIMATION_PERIOD = 1500     # Period of startup animation, in ms
-STARTUP_ANIMATION_FADE_LENGTH = 12  # Number of pixels lit at once in the startup animation
+STARTUP_ANIMATION_PERIOD = const(1500) # Period of startup animation, in ms
+STARTUP_ANIMATION_FADE_LENGTH = const(12) # Number of pixels lit at once in the startup animation
 
 # Spectrum analyser
-AUDIO_SAMPLE_RATE = 48000           # Sampling rate for the audio from the loopback microphone
-AUDIO_SAMPLES_PER_FRAME = 1024      # Number of audio samples (per channel) to record each frame (update cycle)
-ROLLING_FRAMES = 4                  # Length of the rolling window over which the FFT is computed, expressed as a number of frames
-SPECTRUM_FREQUENCY_BINS = 12        # Number of bins to quantise the frequency spectrum into (half the number of LEDs works best)
-AUDIO_AVERAGING_WINDOW = 5          # Number of previous frames used to compute a moving average spectrum - controls 'smoothness'
+AUDIO_SAMPLE_RATE = const(48000)    # Sampling rate for the audio from the loopback microphone
+AUDIO_SAMPLES_PER_FRAME = const(1024) # Number of audio samples (per channel) to record each frame (update cycle)
+ROLLING_FRAMES = const(4)           # Length of the rolling window over which the FFT is computed, expressed as a number of frames
+SPECTRUM_FREQUENCY_BINS = const(12) # Number of bins to quantise the frequency spectrum into (half the number of LEDs works best)
+AUDIO_AVERAGING_WINDOW = const(5)   # Number of previous frames used to compute a moving average spectrum - controls 'smoothness'
+FFT_LENGTH = AUDIO_SAMPLES_PER_FRAME * ROLLING_FRAMES # Number of samples in each FFT (a power of 2 keeps the FFT fast)
+SPECTRUM_KEYFRAME_INTERVAL = const(30) # Maximum number of frames between full spectrum messages (the rest are sent as deltas)
+SPECTRUM_DELTA_STEP = const(4)      # Size of each step in a spectrum delta message, in levels (deltas range from -8 to 7 steps)
 
 # List of all the exceptions in MicroPython (I think - certainly the most common ones anyway)
-EXCEPTIONS = [                      # Byte pattern (reading *anticlockwise*)
+# This is a tuple rather than a list since it never changes, and a tuple is immutable and smaller than a list
+EXCEPTIONS = (                      # Byte pattern (reading *anticlockwise*)
     AssertionError,                 # 00000000
     AttributeError,                 # 10000000
     ImportError,                    # 01000000
@@ -80,4 +103,8 @@ EXCEPTIONS = [                      # Byte pattern (reading *anticlockwise*)
     TypeError,                      # 10110000
     ValueError,                     # 01110000
     ZeroDivisionError               # 11110000
-]
\ No newline at end of file
+)
+
+# Lookup from exception type to the byte value to display, so the common case doesn't need to scan the list above
+# No bit reversal is needed here since display_bytes() already lights the least significant bit first
+EXCEPTION_CODES = {ex_type: i for i, ex_type in enumerate(EXCEPTIONS)}
\ No newline at end of file
@@ -10,60 +10,80 @@ messages differs between the device (stdin/out) and host (pyserial), this is don
 common, it guarantees that the device and host interpret messages the same way.
 """
 
+import struct
+
 from constants import *
 
 ### Globals ###
-MESSAGE_REGISTRY = [] # List of message types, index is the message ID
+MESSAGE_REGISTRY = [] # List of message types, index is the message ID (converted to a tuple once registration is done)
+MESSAGE_SIZES = []    # Payload size of each message type (excluding the ID byte), index is the message ID
+MAX_MESSAGE_SIZE = 0  # Size of the largest registered message type (excluding the ID byte), used to size receive buffers
 
 ### Classes ###
 
 class Message:
 
-    def __init__(self, size = 0):
+    msg_id = None # Message ID, assigned to each message type when it is registered
+    size = 0      # Payload size in bytes (excluding the ID byte); subclasses that send additional data override this
+    FORMAT = None # Struct format for multi-byte payloads (single-byte payloads are simply indexed directly)
+    _encoded = None # Pre-encoded bytes for messages with no payload, set when the message type is registered
+    _buffer = None  # Reusable encode buffer (with the ID already written) for messages with a payload, likewise
+    _instance = None # Shared instance for messages with no payload, likewise (they're all identical anyway)
+
+    def __init__(self):
         """
-        Creates a new message. Subclasses should override this if they need to send additional data, calling this
-        superconstructor to pass in the message size (in bytes, excluding the ID byte). This must be done using
-        optional arguments only, so that the decoder can construct a 'blank' instance before populating it via from_bytes().
+        Creates a new message. Subclasses should override this if they need to send additional data, and declare
+        the message size as a class attribute so it can be looked up without creating a message. This must be done
+        using optional arguments only, so that the decoder can construct a 'blank' instance before populating it via
+        from_bytes().
         """
-        self.size = size
+        pass
 
     def encode(self) -> bytes:
         """
         Encodes this message as a sequence of bytes and returns the result.
-        Subclasses should not override this method! Override from_bytes() instead.
-        (It's done this way so that the empty array can be created centrally, and so we can ensure that the
+        Subclasses should not override this method! Override to_bytes() instead.
+        (It's done this way so that the buffer can be created centrally, and so we can ensure that the
         ID always comes first no matter where super() is called, even if it is never called)
+
+        Note that the returned buffer is shared between all messages of the same type and will be overwritten the
+        next time one is encoded, so it should be written out (or copied) straight away.
         """
-        data = self.to_bytes([])
-        data.insert(0, MESSAGE_REGISTRY.index(type(self)))
-        return bytes(data)
+        # Messages with no payload always encode to the same single byte, so there's nothing to do
+        if self._encoded is not None: return self._encoded
+        # Messages are fixed-length so each type can reuse one buffer, allocated at its final size when registered,
+        # rather than allocating a new one every time (which adds up for messages sent every frame)
+        buf = self._buffer
+        self.to_bytes(buf, 1)
+        return buf
 
     def decode(self, data_bytes: bytes):
         """
         Decodes this message from the given sequence of bytes.
-        Subclasses should not override this method! Override to_bytes() instead.
+        Subclasses should not override this method! Override from_bytes() instead.
         """
-        # A bit overkill to have a separate wrapper method here but I want the conversion to list done inside the class
-        # for consistency, plus we may want to do other stuff in this method later
-        self.from_bytes(list(data_bytes))
+        if self._encoded is not None: return # No payload to decode
+        # Bytes are read in place via a memoryview rather than being copied into a list and popped off one at a
+        # time, so slicing the data in from_bytes() doesn't copy it either
+        self.from_bytes(memoryview(data_bytes), 0)
 
     # Internal methods
 
-    def to_bytes(self, data: list) -> list:
+    def to_bytes(self, buf: bytearray, offset: int):
         """
-        Called from encode() to populate the message with bytes of data. Subclasses can override this and
-        populate it with whatever data is required. If no additional data (other than the message ID) is
-        needed, this method need not be overridden. Ensure data is processed in the same order as from_bytes()
-        (this includes calls to super())
+        Called from encode() to populate the message with bytes of data. Subclasses can override this and write
+        whatever data is required into the given buffer, starting at the given offset (the buffer is pre-sized
+        according to the message size). If no additional data is needed, this method need not be overridden.
+        Ensure data is processed in the same order as from_bytes() (this includes calls to super())
         """
-        return data
+        pass
 
-    def from_bytes(self, data: list):
+    def from_bytes(self, data: bytes, offset: int):
         """
-        Called from decode() to read this message's values from the given list of bytes. Subclasses can
-        override this and do the reverse of whatever data was populated in to_bytes(). The recommended way
-        to do this is using data.pop(0) to avoid needing to use indices. Ensure data is processed in the same
-        order as from_bytes() (this includes calls to super())
+        Called from decode() to read this message's values from the given bytes, starting at the given offset.
+        Subclasses can override this and do the reverse of whatever data was populated in to_bytes(), either
+        by indexing directly or using struct.unpack_from(). Ensure data is processed in the same order as
+        to_bytes() (this includes calls to super())
         """
         pass
 
@@ -78,16 +98,17 @@ class IDMessage(Message):
     - id (1 byte, representing the device type identifier unique to volume knob devices)
     """
 
+    size = 1
+
     def __init__(self, id = 0):
-        super().__init__(size = 1)
+        super().__init__()
         self.id = id
 
-    def to_bytes(self, data: list) -> list:
-        data.append(self.id)  # type: ignore
-        return data
+    def to_bytes(self, buf: bytearray, offset: int):
+        buf[offset] = self.id
 
-    def from_bytes(self, data: list):
-        self.id = data.pop(0)
+    def from_bytes(self, data: bytes, offset: int):
+        self.id = data[offset]
 
 
 class LogMessage(Message):
@@ -105,23 +126,27 @@ class LogMessage(Message):
     The input string will be truncated or padded with spaces to make it exactly 62 bytes long. Trailing
     spaces should be removed on the receiving end before logging the message.
     """
+    PADDING = memoryview(bytes((SPACE_ASCII,)) * 62) # Slices of a memoryview don't copy, so this is never reallocated
+    size = 63
+
     def __init__(self, level = 0, msg = ""):
-        super().__init__(size = 63)
+        super().__init__()
         self.level = level
         self.msg = msg
 
-    def to_bytes(self, data: list) -> list:
-        data.append(self.level)
-        # Seems a bit silly to go from string to bytes to ints and then back to bytes but we've set things up
-        # that way now! Maybe in future we'll change it so these functions handle raw bytes objects...
-        chars = self.msg.encode("utf-8")
-        for i in range(62):
-            data.append(int(chars[i]) if i < len(chars) else SPACE_ASCII)
-        return data
+    def to_bytes(self, buf: bytearray, offset: int):
+        chars = self.msg.encode("utf-8")[:62]
+        n = len(chars)
+        buf[offset] = self.level
+        buf[offset + 1 : offset + 1 + n] = chars
+        # Pad with spaces rather than nulls, copying them straight from a preallocated run of spaces (MicroPython's
+        # bytes has no ljust(), and building the padding each time would mean another allocation per log message)
+        buf[offset + 1 + n : offset + 63] = self.PADDING[n:]
 
-    def from_bytes(self, data: list):
-        self.level = data.pop(0)
-        self.msg = bytes(data).decode("utf-8").rstrip() # data should only contain the msg string now
+    def from_bytes(self, data: bytes, offset: int):
+        self.level = data[offset]
+        # Strip the padding off the raw bytes before decoding, so it isn't decoded only to be thrown away again
+        self.msg = bytes(data[offset + 1 : offset + 63]).rstrip().decode("utf-8")
 
 
 class VolumeRequestMessage(Message):
@@ -146,17 +171,18 @@ class VolumeMessage(Message):
     - volume (1 byte, where 0 is muted and 255 is max. volume)
     """
 
+    size = 1
+
     def __init__(self, volume = 0.0):
-        super().__init__(size = 1)
+        super().__init__()
         if volume < 0 or volume > 1: raise ValueError(f"Invalid volume level: {volume}")
         self.volume = volume
 
-    def to_bytes(self, data: list) -> list:
-        data.append(int(self.volume * 255))
-        return data
+    def to_bytes(self, buf: bytearray, offset: int):
+        buf[offset] = int(self.volume * 255)
 
-    def from_bytes(self, data: list):
-        self.volume = data.pop(0) / 255 # Automatic conversion to float
+    def from_bytes(self, data: bytes, offset: int):
+        self.volume = data[offset] / 255 # Automatic conversion to float
 
 
 class TogglePlaybackMessage(Message):
@@ -181,16 +207,17 @@ class PlaybackStatusMessage(Message):
     - playing (1 byte, where 0 is paused and 1 is playing)
     """
 
+    size = 1
+
     def __init__(self, playing = False):
-        super().__init__(size = 1)
+        super().__init__()
         self.playing = playing
 
-    def to_bytes(self, data: list) -> list:
-        data.append(int(self.playing))  # type: ignore  # What the heck is wrong with this, vscode?
-        return data
+    def to_bytes(self, buf: bytearray, offset: int):
+        buf[offset] = int(self.playing)
 
-    def from_bytes(self, data: list):
-        self.playing = bool(data.pop(0))
+    def from_bytes(self, data: bytes, offset: int):
+        self.playing = bool(data[offset])
 
 
 class SkipMessage(Message):
@@ -203,16 +230,17 @@ class SkipMessage(Message):
     - forward (1 byte, where 0 is backwards and 1 is forwards)
     """
 
+    size = 1
+
     def __init__(self, forward = False):
-        super().__init__(size = 1)
+        super().__init__()
         self.forward = forward
 
-    def to_bytes(self, data: list) -> list:
-        data.append(int(self.forward))  # type: ignore
-        return data
+    def to_bytes(self, buf: bytearray, offset: int):
+        buf[offset] = int(self.forward)
 
-    def from_bytes(self, data: list):
-        self.forward = bool(data.pop(0))
+    def from_bytes(self, data: bytes, offset: int):
+        self.forward = bool(data[offset])
 
 
 class VUMessage(Message):
@@ -224,21 +252,25 @@ class VUMessage(Message):
     Additional data:
     - left (1 byte, representing the left channel volume)
     - right (1 byte, representing the right channel volume)
+
+    ---
+    The levels are stored as raw integers (0-255) rather than floats, since the Pico has no FPU and the levels only
+    end up as LED colours anyway. The host should quantise before sending.
     """
 
-    def __init__(self, left = 0.0, right = 0.0):
-        super().__init__(size = 2)
+    FORMAT = "BB"
+    size = 2
+
+    def __init__(self, left = 0, right = 0):
+        super().__init__()
         self.left  = left
         self.right = right
 
-    def to_bytes(self, data: list) -> list:
-        data.append(int(self.left  * 255))
-        data.append(int(self.right * 255))
-        return data
+    def to_bytes(self, buf: bytearray, offset: int):
+        struct.pack_into(self.FORMAT, buf, offset, self.left, self.right)
 
-    def from_bytes(self, data: list):
-        self.left  = data.pop(0) / 255 # Automatic conversion to float
-        self.right = data.pop(0) / 255
+    def from_bytes(self, data: bytes, offset: int):
+        self.left, self.right = struct.unpack_from(self.FORMAT, data, offset)
 
 
 class SpectrumMessage(Message):
@@ -250,22 +282,89 @@ class SpectrumMessage(Message):
     Additional data:
     - left (12 bytes, representing the left channel frequency spectrum)
     - right (12 bytes, representing the right channel frequency spectrum)
+
+    ---
+    As with `VUMessage`, the spectrum levels are stored as raw bytes (0-255) rather than floats. This lets the
+    host quantise an entire spectrum in a single vectorised numpy operation, and means the device can use the levels
+    directly in integer maths. Any bytes-like object (bytes, bytearray, memoryview) may be passed in.
+
+    When decoded, `left` and `right` are memoryview slices of the received data rather than copies, so nothing is
+    allocated per level. They are only valid for as long as that data is, so copy them if they need to be kept.
     """
 
+    size = SPECTRUM_FREQUENCY_BINS * 2
+
     def __init__(self, left = None, right = None):
-        super().__init__(size = SPECTRUM_FREQUENCY_BINS * 2)
-        self.left =  [] if left  is None else left
-        self.right = [] if right is None else right
+        super().__init__()
+        self.left =  b"" if left  is None else left
+        self.right = b"" if right is None else right
 
-    def to_bytes(self, data: list) -> list:
-        for v in self.left:  data.append(int(v * 255))
-        for v in self.right: data.append(int(v * 255))
-        return data
+    def to_bytes(self, buf: bytearray, offset: int):
+        # Length check is important here since slice assignment would otherwise resize the buffer
+        if len(self.left) != SPECTRUM_FREQUENCY_BINS or len(self.right) != SPECTRUM_FREQUENCY_BINS:
+            raise ValueError(f"Invalid spectrum length: {len(self.left)}, {len(self.right)}")
+        buf[offset : offset + SPECTRUM_FREQUENCY_BINS] = self.left
+        buf[offset + SPECTRUM_FREQUENCY_BINS : offset + SPECTRUM_FREQUENCY_BINS * 2] = self.right
 
-    def from_bytes(self, data: list):
-        self.data = data
-        self.left  = [v/255 for v in data[:SPECTRUM_FREQUENCY_BINS]]
-        self.right = [v/255 for v in data[SPECTRUM_FREQUENCY_BINS:]]
+    def from_bytes(self, data: bytes, offset: int):
+        self.left  = data[offset : offset + SPECTRUM_FREQUENCY_BINS]
+        self.right = data[offset + SPECTRUM_FREQUENCY_BINS : offset + SPECTRUM_FREQUENCY_BINS * 2]
+
+
+class SpectrumDeltaMessage(Message):
+    """
+    Message sent to update the device's spectrum relative to the previous one, at half the size of a full
+    `SpectrumMessage`.
+    
+    Direction: Host -> Device
+    
+    Additional data:
+    - packed (12 bytes, representing 24 signed 4-bit deltas: the left channel bins followed by the right channel bins,
+    two per byte with the first in the high nibble)
+
+    ---
+    Each delta is a whole number of `SPECTRUM_DELTA_STEP`s between -8 and 7, so the receiver must already have a
+    spectrum to apply it to; the host sends a full `SpectrumMessage` as a keyframe every so often (and whenever the
+    spectrum changes too quickly for a delta to keep up). Both ends should update their copy of the spectrum using
+    `apply()` so that they stay in step.
+    """
+
+    size = SPECTRUM_FREQUENCY_BINS
+
+    def __init__(self, deltas = None):
+        super().__init__()
+        if deltas is None:
+            self.packed = b"" # Replaced by from_bytes() when decoding, so don't allocate a buffer for it
+        else:
+            self.packed = bytearray(SPECTRUM_FREQUENCY_BINS)
+            for i in range(SPECTRUM_FREQUENCY_BINS):
+                self.packed[i] = ((int(deltas[2*i]) & 0xF) << 4) | (int(deltas[2*i+1]) & 0xF)
+
+    def apply(self, levels: bytearray):
+        """
+        Applies these deltas to the given spectrum in place, clamping the results to 0-255. The spectrum must be
+        `SPECTRUM_FREQUENCY_BINS * 2` bytes long (left channel followed by right channel).
+        """
+        # This runs on the device for every frame of audio, so the two nibbles of each byte are written out separately
+        # rather than looping over them, which would allocate a tuple for every byte
+        packed = self.packed
+        for i in range(SPECTRUM_FREQUENCY_BINS):
+            b = packed[i]
+            j = i * 2
+            d = b >> 4
+            if d > 7: d -= 16 # Sign extend
+            v = levels[j] + d * SPECTRUM_DELTA_STEP
+            levels[j] = 0 if v < 0 else 255 if v > 255 else v
+            d = b & 0xF
+            if d > 7: d -= 16
+            v = levels[j + 1] + d * SPECTRUM_DELTA_STEP
+            levels[j + 1] = 0 if v < 0 else 255 if v > 255 else v
+
+    def to_bytes(self, buf: bytearray, offset: int):
+        buf[offset : offset + SPECTRUM_FREQUENCY_BINS] = self.packed
+
+    def from_bytes(self, data: bytes, offset: int):
+        self.packed = data[offset : offset + SPECTRUM_FREQUENCY_BINS]
 
 
 class LikeMessage(Message):
@@ -290,16 +389,17 @@ class LikeStatusMessage(Message):
     - liked (1 byte, where 0 is not liked and 1 is liked)
     """
 
+    size = 1
+
     def __init__(self, liked = False):
-        super().__init__(size = 1)
+        super().__init__()
         self.liked = liked
 
-    def to_bytes(self, data: list) -> list:
-        data.append(int(self.liked))  # type: ignore
-        return data
+    def to_bytes(self, buf: bytearray, offset: int):
+        buf[offset] = int(self.liked)
 
-    def from_bytes(self, data: list):
-        self.liked = bool(data.pop(0))
+    def from_bytes(self, data: bytes, offset: int):
+        self.liked = bool(data[offset])
 
 
 class DisconnectMessage(Message):
@@ -332,20 +432,62 @@ def register(message_type: type[Message]):
     """
     Registers the given class as a message type. The class must inherit from Message.
     """
-    #if not issubclass(message_class, Message): raise TypeError("Cannot register message type; must inherit from Message")
+    global MAX_MESSAGE_SIZE
+    if not issubclass(message_type, Message): raise TypeError("Cannot register message type; must inherit from Message")
+    if isinstance(MESSAGE_REGISTRY, tuple): raise RuntimeError("Cannot register message type; registry is frozen")
+    # Store the ID on the class itself so encoding doesn't have to search the registry for it every time
+    message_type.msg_id = len(MESSAGE_REGISTRY)
+    size = message_type.size
+    MAX_MESSAGE_SIZE = max(MAX_MESSAGE_SIZE, size)
+    # Messages with no payload are all identical, so they can be encoded once here and the bytes shared
+    if size == 0:
+        message_type._encoded = bytes((message_type.msg_id,))
+        message_type._instance = message_type()
+    else:
+        message_type._buffer = bytearray(1 + size)
+        message_type._buffer[0] = message_type.msg_id
     MESSAGE_REGISTRY.append(message_type)
+    MESSAGE_SIZES.append(size)
     
 
-def msg_from_id(id_byte: bytes) -> Message:
+def msg_from_id(id: int) -> Message:
     """
-    Constructs a blank message from its ID, ready to receive bytes of data.
+    Constructs a blank message from its ID, ready to receive bytes of data. Messages with no payload are never
+    constructed; the shared instance for that type is returned instead.
+
+    The ID is taken as an int (i.e. the first byte of the message, already indexed out of the receive buffer) so that
+    callers don't need to slice out a separate bytes object for it.
     """
-    id = int(id_byte[0])
     if id >= len(MESSAGE_REGISTRY): raise IndexError("Invalid message ID!")
-    msg = MESSAGE_REGISTRY[id]() # Empty brackets because we're calling the constructor here
+    message_type = MESSAGE_REGISTRY[id]
+    if message_type._instance is not None: return message_type._instance
+    msg = message_type() # Empty brackets because we're calling the constructor here
     return msg
 
 
+def freeze_registry():
+    """
+    Converts the message registry to a tuple once all message types have been registered. This stops any later
+    registrations from changing the message IDs.
+    """
+    global MESSAGE_REGISTRY, MESSAGE_SIZES
+    MESSAGE_REGISTRY = tuple(MESSAGE_REGISTRY)
+    MESSAGE_SIZES = tuple(MESSAGE_SIZES)
+
+
+def encode_batch(msgs) -> bytes:
+    """
+    Encodes the given sequence of messages back-to-back into a single bytes object, so they can be sent with one
+    write call. Since every message type has a fixed length, the receiving end can read them back out one by one
+    as normal.
+    """
+    # Each message must be copied out as soon as it is encoded, since messages of the same type share a buffer
+    data = bytearray()
+    for msg in msgs:
+        data += msg.encode()
+    return bytes(data)
+
+
 # Message registry
 register(IDMessage)
 register(LogMessage)
@@ -359,4 +501,6 @@ register(SpectrumMessage)
 register(LikeMessage)
 register(LikeStatusMessage)
 register(DisconnectMessage)
-register(ExitMessage)
\ No newline at end of file
+register(ExitMessage)
+register(SpectrumDeltaMessage)
+freeze_registry()
\ No newline at end of file
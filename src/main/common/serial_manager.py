@@ -5,6 +5,7 @@ Base class for both host and device serial managers. Deals with message handler
 sides of the serial connection.
 """
 
+from constants import *
 import message_protocol as msp
 
 
@@ -28,7 +29,11 @@ class SerialManager():
         """
         Creates and initialises a new serial manager.
         """
-        self.message_handlers = {} # Dictionary mapping message types to handler functions
+        # Handler function for each message type, indexed by message ID (None if there is no handler for that type)
+        # Message IDs are small consecutive integers, so a list is quicker to look up than a dictionary keyed by type
+        self.message_handlers = [None] * len(msp.MESSAGE_REGISTRY)
+        # Every message is read into the same buffer (big enough for the largest one) rather than allocating new bytes
+        self.rx_buffer = memoryview(bytearray(1 + msp.MAX_MESSAGE_SIZE))
 
 
     def register_handler(self, message_type: type, handler):
@@ -36,41 +41,72 @@ class SerialManager():
         Registers the given handler function for the given message type.
         This will replace any existing handler for that message type.
         """
-        self.message_handlers[message_type] = handler
+        self.message_handlers[message_type.msg_id] = handler
 
 
-    def update(self):
+    def update(self) -> bool:
         """
         Called from the main program loop to update the serial manager.
+
+        #### Returns
+        `True` if there may still be messages waiting because the per-update limit was reached, `False` otherwise.
+
+        ---
+        At most `MAX_MESSAGES_PER_UPDATE` messages are handled each time, so that a burst of incoming messages can't
+        hold up the rest of the main loop; any left over are handled on the next update.
         """
-        while self.bytes_waiting(): # Keep reading messages until there are none waiting
-            msg, raw = self.read_next_msg()
-            self.handle(msg, raw)
+        for _ in range(MAX_MESSAGES_PER_UPDATE):
+            if not self.bytes_waiting(): return False
+            msg, raw = self.read_next_msg(skip_unhandled = True)
+            if msg is not None: self.handle(msg, raw)
+        return True
 
         
-    def read_next_msg(self) -> tuple[msp.Message, bytes]:
+    def read_next_msg(self, skip_unhandled = False) -> tuple[msp.Message, bytes]:
         """
         Reads a single message from the input buffer and returns the resulting message object.
+
+        #### Parameters
+        ##### Optional
+        - `skip_unhandled`: If `True`, messages with no registered handler are read and discarded without constructing
+        a `Message` object for them, and `None` is returned in place of the message. Defaults to `False`.
         
         #### Returns
-        - `msg`: The resulting `Message` object.
-        - `raw`: The raw `bytes` object, for logging purposes.
-        """
-        id = self.read(1) # Read the first byte from the input - this should be the message ID
-        raw = id # Need to set this here in case the message has no additional data
+        - `msg`: The resulting `Message` object, or `None` if it was skipped.
+        - `raw`: The raw bytes, for logging purposes.
+
+        ---
+        The raw bytes (and any data the message decoded as views, e.g. spectrum levels) point into the shared receive
+        buffer, so they are only valid until the next message is read.
+        """
+        rx = self.rx_buffer
+        # Read the first byte from the input - this should be the message ID
+        if not self.readinto(rx[:1]): raise IndexError("No message received")
+        id = rx[0]
+
+        if skip_unhandled:
+            if id >= len(msp.MESSAGE_SIZES): raise IndexError("Invalid message ID!")
+            if self.message_handlers[id] is None:
+                # Nothing to do with this message, so just consume its data (saves allocating an object on the device)
+                size = msp.MESSAGE_SIZES[id]
+                if size > 0:
+                    received = self.readinto(rx[1 : 1 + size])
+                    if received < size: # Same error as below, but there's no message object so use its class
+                        raise IndexError(f"Incomplete message: expected {size} byte(s), received {received} byte(s). "
+                                         f"Message type: {msp.MESSAGE_REGISTRY[id]}")
+                return None, rx[:1 + size]
 
         # Reconstruct message object
         msg = msp.msg_from_id(id)
 
         # Decode additional message data
         if msg.size > 0: # Some messages contain no additional data
-            data_bytes = self.read(msg.size)
-            if not data_bytes: raise_msg_error(msg, 0)
-            if len(data_bytes) < msg.size: raise_msg_error(msg, len(data_bytes))
+            data_bytes = rx[1 : 1 + msg.size]
+            received = self.readinto(data_bytes)
+            if received < msg.size: raise_msg_error(msg, received)
             msg.decode(data_bytes)
-            raw += data_bytes
 
-        return msg, raw
+        return msg, rx[:1 + msg.size]
 
     
     def handle(self, msg: msp.Message, raw: bytes):
@@ -78,8 +114,8 @@ class SerialManager():
         Call the handler (if it exists) for this type of message to do whatever it needs to do
         Subclasses may extend functionality with e.g. logging
         """
-        if type(msg) in self.message_handlers:
-            self.message_handlers[type(msg)](msg)
+        handler = self.message_handlers[msg.msg_id]
+        if handler is not None: handler(msg)
 
 
     ### Abstract Methods ###
@@ -98,16 +134,16 @@ class SerialManager():
         raise NotImplementedError("Attempted to call send() for the base SerialManager class")
 
         
-    def read(self, n: int) -> bytes:
+    def readinto(self, buf) -> int:
         """
-        Reads and returns n bytes from the serial input buffer.
+        Reads bytes from the serial input buffer into the given buffer, until it is full.
         
         #### Parameters
         ##### Required
-        - `n`: The number of bytes to read
+        - `buf`: The writable buffer (e.g. a `memoryview` slice) to read into. Its length is the number of bytes to read.
 
         #### Returns
-        A `bytes` object containing the values read from the input buffer.
+        The number of bytes actually read, which may be fewer than requested if the read timed out.
         
         ---
         This method is only called after checking that there are bytes waiting; as such the read
@@ -115,7 +151,7 @@ class SerialManager():
 
         Subclasses should implement this with the relevant code for their end of the connection.
         """
-        raise NotImplementedError("Attempted to call read() for the base SerialManager class")
+        raise NotImplementedError("Attempted to call readinto() for the base SerialManager class")
     
 
     def bytes_waiting(self) -> bool:
@@ -6,6 +6,8 @@ Module responsible for overall control flow on the device end. The run() functio
 
 import utime
 import sys
+import micropython
+from array import array
 
 from constants import * # Usually considered bad practice but here I think it improves readability
 
@@ -16,7 +18,7 @@ from rotary_encoder import Encoder
 ### Setup ###
 
 # Hardware
-leds = LedRing(PIXEL_DATA_PIN, PIXEL_COUNT, PIXEL_OFFSET)
+leds = LedRing(PIXEL_DATA_PIN, PIXEL_COUNT, PIXEL_OFFSET, dither = PIXEL_DITHERING)
 encoder = Encoder(ENCODER_A_PIN, ENCODER_B_PIN, ENCODER_SW_PIN, ENCODER_PPR)
 
 from device_serial_manager import DeviceSerialManager
@@ -27,12 +29,25 @@ import state_machine
 serial_manager = DeviceSerialManager()
 
 running = True
+next_led_update = utime.ticks_ms() # Deadline for the next LED refresh
+
+spectrum = bytearray(SPECTRUM_FREQUENCY_BINS * 2) # Current spectrum levels (left then right), kept for delta messages
+spectrum_hsv = array("H", [0] * (PIXEL_COUNT * 3)) # Working buffer for the spectrum colours (h, s, v for each pixel)
+VISUALISER_BRIGHTNESS = int(AUDIO_VISUALISER_BRIGHTNESS * 256) # As a fixed-point fraction of 256, to avoid float maths
+SPECTRUM_HUES = array("H", (280 - i * 14 for i in range(SPECTRUM_FREQUENCY_BINS))) # Base hue of each spectrum bin (purple through to green)
+# Colour for each VU level, so the handler only has to look it up; stored as a flat array of h, s, v values (3 per level)
+# rather than as 256 tuples, which would take up several times the memory
+VU_COLOURS = array("H", (c for v in range(256)
+                         for c in (240 - (v * 100 >> 8), 255 - (v * 230 >> 8), (200 + (v * 55 >> 8)) * VISUALISER_BRIGHTNESS >> 8)))
+
+ERROR_CODE_BUFFER = bytearray(1) # Allocated up front so displaying an error code can't itself run out of memory
 
 
 def init():
     serial_manager.register_handler(msp.VolumeMessage,      handle_volume_msg)
     serial_manager.register_handler(msp.VUMessage,          handle_vu_msg)
     serial_manager.register_handler(msp.SpectrumMessage,    handle_spectrum_msg)
+    serial_manager.register_handler(msp.SpectrumDeltaMessage, handle_spectrum_delta_msg)
     serial_manager.register_handler(msp.LikeStatusMessage,  handle_like_status_msg)
     serial_manager.register_handler(msp.DisconnectMessage,  handle_disconnect_msg)
     serial_manager.register_handler(msp.ExitMessage,        handle_exit_msg)
@@ -42,35 +57,79 @@ def init():
 
 def handle_volume_msg(msg: msp.VolumeMessage):
     leds.crossfade(200)
-    state_machine.set_state(state_machine.VolumeAdjustState(msg.volume))
-
-
-def handle_vu_msg(msg: msp.VUMessage):
-    if state_machine.get_current_state().should_display_audio():
-        leds.set_colour((240 - int(msg.left * 100), 255 - int(msg.left * 230), (200 + int(msg.left * 55)) * AUDIO_VISUALISER_BRIGHTNESS))
-
-
-def handle_spectrum_msg(msg: msp.SpectrumMessage):
-    # TODO: Temporary, will be replaced with a dedicated handshake message that also syncs across settings
-    if state_machine.is_in_state(state_machine.StartupState): state_machine.set_state(state_machine.IdleState())
-    if state_machine.get_current_state().should_display_audio():
-        for i, v in enumerate(msg.left):
-            leds.set_pixel(PIXEL_COUNT-i-1, (280 - i * 14 - int(v * 100), 255 - int(v * 180), (190 + int(v * 65)) * AUDIO_VISUALISER_BRIGHTNESS))
-        for i, v in enumerate(msg.right):
-            leds.set_pixel(i+1,             (280 - i * 14 - int(v * 100), 255 - int(v * 180), (190 + int(v * 65)) * AUDIO_VISUALISER_BRIGHTNESS))
+    state_machine.set_state(state_machine.VolumeAdjustState, msg.volume)
+
+
+# The audio handlers run for every frame of audio, so the globals they use are bound as default arguments; MicroPython
+# then loads them as locals instead of looking them up in the module's dictionary every time (don't pass these in!)
+# They (and the main loop) are also compiled to machine code with the native emitter, which skips the bytecode
+# interpreter at the cost of a bit more RAM - so this is only worth doing for small functions that run constantly
+
+@micropython.native
+def handle_vu_msg(msg: msp.VUMessage, _sm = state_machine, _set_colour = leds.set_colour_hsv, _colours = VU_COLOURS):
+    if _sm.display_audio:
+        i = msg.left * 3 # Raw 0-255 level, so it can index the table directly
+        _set_colour(_colours[i], _colours[i + 1], _colours[i + 2])
+
+
+@micropython.native
+def handle_spectrum_msg(msg: msp.SpectrumMessage, _spectrum = spectrum):
+    _spectrum[:SPECTRUM_FREQUENCY_BINS] = msg.left
+    _spectrum[SPECTRUM_FREQUENCY_BINS:] = msg.right
+    display_spectrum()
+
+
+@micropython.native
+def handle_spectrum_delta_msg(msg: msp.SpectrumDeltaMessage, _spectrum = spectrum):
+    msg.apply(_spectrum)
+    display_spectrum()
+
+
+@micropython.viper
+def _spectrum_to_hsv(levels: ptr8, hues: ptr16, out: ptr16, bins: int, last: int, brightness: int):
+    """
+    [Internal] Converts the given spectrum levels to a colour for each pixel, writing them into the given buffer as
+    h, s, v triples in pixel order. The left channel goes anticlockwise from the back and the right goes clockwise.
+    """
+    # Viper compiles this down to plain integer machine code, with no int objects allocated along the way
+    # Spectrum levels are raw bytes (0-255), so scale with integer maths rather than converting to float
+    # Shifting right by 8 divides by 256 rather than 255, which is close enough here and much cheaper
+    for i in range(bins):
+        h = hues[i] # Both channels share the same hue ramp
+        v = levels[i]
+        j = (last - i) * 3
+        out[j]     = h - (v * 100 >> 8)
+        out[j + 1] = 255 - (v * 180 >> 8)
+        out[j + 2] = (190 + (v * 65 >> 8)) * brightness >> 8
+        v = levels[bins + i]
+        j = (i + 1) * 3
+        out[j]     = h - (v * 100 >> 8)
+        out[j + 1] = 255 - (v * 180 >> 8)
+        out[j + 2] = (190 + (v * 65 >> 8)) * brightness >> 8
+
+
+@micropython.native
+def display_spectrum(_spectrum = spectrum, _hsv = spectrum_hsv, _to_hsv = _spectrum_to_hsv, _set_pixels = leds.set_pixels,
+                     _sm = state_machine):
+    if not _sm.display_audio:
+        # TODO: Temporary, will be replaced with a dedicated handshake message that also syncs across settings
+        # (the startup state never displays audio, so it only needs checking for when the flag is off)
+        if _sm.is_in_state(_sm.StartupState): _sm.set_state(_sm.IdleState)
+        if not _sm.display_audio: return
+    _to_hsv(_spectrum, SPECTRUM_HUES, _hsv, SPECTRUM_FREQUENCY_BINS, PIXEL_COUNT - 1, VISUALISER_BRIGHTNESS)
+    _set_pixels(_hsv, 1) # The pixel above the USB isn't part of the visualiser
 
 
 def handle_like_status_msg(msg: msp.LikeStatusMessage):
     if state_machine.is_in_state(state_machine.PressedState):
         if msg.liked:
-            leds.set_colour(LIKE_COLOUR)
-            leds.crossfade(LED_ANIMATION_DURATION)
+            leds.flash(LIKE_COLOUR, LED_ANIMATION_DURATION)
         else:
-            state_machine.set_state(state_machine.UnlikeAnimationState())
+            state_machine.set_state(state_machine.UnlikeAnimationState)
 
 
 def handle_disconnect_msg(msg: msp.DisconnectMessage):
-    state_machine.set_state(state_machine.StartupState())
+    state_machine.set_state(state_machine.StartupState)
 
 
 def handle_exit_msg(msg: msp.ExitMessage):
@@ -84,27 +143,48 @@ def run():
 
     try:
         init()
+        loop = update_loop # Local lookup for the function itself too
         while running:
-            update_loop()
+            loop()
 
     except Exception as e:
-        log.critical(f"{type(e).__name__}: {e}")
+        log.exception(e)
         leds.set_colour((0, 255, 255))
         leds.update()
         utime.sleep(1)
-        for i, ex_type in enumerate(EXCEPTIONS):
-            if isinstance(e, ex_type):
-                leds.display_bytes(bytes([i]))
-                # Re-throw the error so main.py will catch it in an infinite loop rather than dumping out to the REPL
-                # That way the serial output won't get flushed and we can actually read the error description
-                raise e
+        code = EXCEPTION_CODES.get(type(e))
+        if code is None:
+            # Not one of the listed types exactly, so fall back to checking for subclasses
+            for i, ex_type in enumerate(EXCEPTIONS):
+                if isinstance(e, ex_type):
+                    code = i
+                    break
+        if code is not None:
+            ERROR_CODE_BUFFER[0] = code
+            leds.display_bytes(ERROR_CODE_BUFFER)
+            # Re-throw the error so main.py will catch it in an infinite loop rather than dumping out to the REPL
+            # That way the serial output won't get flushed and we can actually read the error description
+            raise e
             
-    # Turn LEDs off before exiting
+    # Turn LEDs off before exiting, and hand back their state machine
     leds.clear()
     leds.update()
-
-
-def update_loop():
-    serial_manager.update()
-    leds.update()
-    state_machine.update()
\ No newline at end of file
+    leds.release()
+
+
+# As with the audio handlers, everything the main loop calls is bound as a default argument so that it's a local lookup
+# rather than a global lookup followed by an attribute lookup, every time round (again, don't pass these in!)
+@micropython.native
+def update_loop(_serial_update = serial_manager.update, _leds_update = leds.update, _sm_update = state_machine.update,
+                _ticks_ms = utime.ticks_ms, _ticks_diff = utime.ticks_diff, _ticks_add = utime.ticks_add):
+    global next_led_update
+    _serial_update()
+    # Refreshing the LEDs is by far the slowest part of the loop, so do it on a fixed schedule rather than every time
+    # round; that way incoming messages are still dealt with promptly while a refresh isn't due
+    now = _ticks_ms()
+    if _ticks_diff(now, next_led_update) >= 0:
+        _leds_update() # Returns straight away if nothing has changed (e.g. idle with no audio playing)
+        next_led_update = _ticks_add(next_led_update, LED_REFRESH_INTERVAL)
+        # If we've fallen more than a whole interval behind, start again from now rather than trying to catch up
+        if _ticks_diff(now, next_led_update) >= 0: next_led_update = _ticks_add(now, LED_REFRESH_INTERVAL)
+    _sm_update()
\ No newline at end of file
@@ -12,15 +12,22 @@ import device_controller as device
 
 ### Constants ###
 
-CRITICAL = 50
-ERROR = 40
-WARNING = 30
-INFO = 20
-DEBUG = 10
+CRITICAL = const(50)
+ERROR = const(40)
+WARNING = const(30)
+INFO = const(20)
+DEBUG = const(10)
 # TRACE is already defined in constants module since it is shared by device and host
 
 # Don't want these polluting the main constants file because they'll confuse the actual logging
 
+# Messages below this level are dropped on the device rather than being built and sent to the host. Optimised builds
+# (mpy-cross -O1 and above, as in deploy.bat) have __debug__ set to False, so only unoptimised builds send debug messages
+MIN_LEVEL = DEBUG if __debug__ else INFO
+
+# Encoded up front so that it can still be sent if there isn't enough memory left to build a log message
+OUT_OF_MEMORY_MSG = bytes(msp.LogMessage(CRITICAL, "MemoryError (unable to log details)").encode())
+
 def log(level, msg):
     """
     Logs the given message at the specified log level.
@@ -30,6 +37,7 @@ def log(level, msg):
     - `level`: The log level, as an integer between 0 and 255. Typically this will be one of the predefined constants.
     - `msg`: The message to send. Messages longer than 62 bytes (62 chars if all ASCII) will be truncated.
     """
+    if level < MIN_LEVEL: return
     device.serial_manager.send(msp.LogMessage(level, msg))
 
 
@@ -96,4 +104,21 @@ def trace(msg):
     ##### Required
     - `msg`: The message to send. Messages longer than 62 bytes (62 chars if all ASCII) will be truncated.
     """
-    log(TRACE, msg)
\ No newline at end of file
+    log(TRACE, msg)
+
+
+def exception(e: Exception):
+    """
+    Logs the type and description of the given exception at the `CRITICAL` level. Unlike the equivalent in the logging
+    module, this takes the exception itself rather than a message, so that it can be formatted in here. If there isn't
+    enough memory to do that (e.g. when handling a `MemoryError`), a pre-encoded message is sent instead.
+    
+    #### Parameters
+    ##### Required
+    - `e`: The exception to log.
+    """
+    try:
+        # Plain concatenation rather than an f-string, which would go through str.format and allocate more on the way
+        device.serial_manager.send(msp.LogMessage(CRITICAL, type(e).__name__ + ": " + str(e)))
+    except MemoryError:
+        device.serial_manager.send_encoded(OUT_OF_MEMORY_MSG)
\ No newline at end of file
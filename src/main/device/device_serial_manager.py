@@ -7,11 +7,16 @@ messages.
 
 import sys
 import uselect
+import micropython
 
 from constants import *
 import message_protocol as msp
+import device_logger as log
 from serial_manager import SerialManager
 
+# If the message limit is hit on this many updates in a row, the host is sending faster than we can keep up with
+BACKLOG_WARNING_THRESHOLD = const(100)
+
 
 class DeviceSerialManager(SerialManager):
     """
@@ -24,17 +29,37 @@ class DeviceSerialManager(SerialManager):
         self.stdin_poll = uselect.poll()
         # Not sure why pylance doesn't like the following line
         self.stdin_poll.register(sys.stdin.buffer, uselect.POLLIN) # type: ignore
+        self.backlogged_updates = 0 # Number of consecutive updates that hit the message limit
+
+    def update(self) -> bool:
+        backlogged = super().update()
+        if backlogged:
+            self.backlogged_updates += 1
+            if self.backlogged_updates >= BACKLOG_WARNING_THRESHOLD:
+                log.warning("Serial backlog: host is sending messages faster than they can be handled")
+                self.backlogged_updates = 0
+        else:
+            self.backlogged_updates = 0
+        return backlogged
+
+    def send_encoded(self, data: bytes):
+        """
+        Sends the given bytes as they are; they must already be a complete encoded message (or several).
+        """
+        sys.stdout.buffer.write(data) # type: ignore
 
     ### Method Implementations ###
     
     def send(self, msg: msp.Message):
         sys.stdout.buffer.write(msg.encode()) # type: ignore
 
-    def read(self, n: int) -> bytes:
-        # TODO: Check how this responds if the number of bytes available is not zero but is less than n
+    @micropython.native # Called for every message, so worth compiling to machine code
+    def readinto(self, buf) -> int:
+        # TODO: Check how this responds if the number of bytes available is not zero but is less than len(buf)
         #       In theory we shouldn't encounter this problem since we only read more than 1 byte when we know there is a
         #       message there (and how many bytes it should contain), but for robustness it would be good to nail this down
-        return sys.stdin.buffer.read(n) # type: ignore
+        return sys.stdin.buffer.readinto(buf) or 0 # type: ignore
     
+    @micropython.native
     def bytes_waiting(self) -> bool:
         return bool(self.stdin_poll.poll(0))
\ No newline at end of file
@@ -1,12 +1,25 @@
 import machine
 import utime
+import micropython
+from micropython import const
+from array import array
 
 from neopixel import Neopixel
 
 ### Local Constants ###
 
-MAX_PIOS = 8 # Total number of PIOs (state machines) onboard the Pico
-MAX_BRIGHTNESS = 20
+MAX_PIOS = const(8) # Total number of PIOs (state machines) onboard the Pico
+MAX_BRIGHTNESS = const(20)
+HUE_SCALE = 65535 / 360 # Converts hues in degrees to the 16-bit range used by colorHSV()
+# The same conversion for each whole number of degrees, worked out once here so converting a hue needs no float maths
+# (360 degrees is the same as 0 on the colour wheel, so hues are taken modulo 360 when looking them up)
+HUE_LOOKUP = array("H", (int(h * HUE_SCALE) for h in range(360)))
+COLOUR_CACHE_SIZE = const(128) # Maximum number of converted colours to keep (the cache is emptied when it fills up)
+CHROMA_CACHE_SIZE = const(64) # Maximum number of full-brightness hue/saturation colours to keep, as above
+
+# Colours for the 1 and 0 bits of each byte in display_bytes(), created once here rather than for every bit
+BIT_ON_COLOURS = ((255, 0, 0), (0, 255, 0), (0, 0, 255))
+BIT_OFF_COLOURS = ((10, 0, 0), (0, 10, 0), (0, 0, 10)) # Make the zeros dim rather than completely off
 
 # Lookup table for gamma-corrected 8-bit values
 # https://learn.adafruit.com/led-tricks-gamma-correction/the-quick-fix
@@ -23,7 +36,9 @@ MAX_BRIGHTNESS = 20
 # the light from the LEDs, allowing an increased brightness range (and
 # hence better resolution) to be used for the same end result. However,
 # with the other adjustments this is unlikely to be necessary.
-GAMMA_LOOKUP = [
+# This is stored as bytes rather than a list, so it takes up a single 256-byte buffer rather than a list of 256
+# pointers; indexing it still gives an int.
+GAMMA_LOOKUP = bytes((
       0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,
       0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  1,  1,  1,  1,
       1,  1,  1,  1,  1,  1,  1,  1,  1,  2,  2,  2,  2,  2,  2,  2,
@@ -39,8 +54,16 @@ GAMMA_LOOKUP = [
     115,117,119,120,122,124,126,127,129,131,133,135,137,138,140,142,
     144,146,148,150,152,154,156,158,160,162,164,167,169,171,173,175,
     177,180,182,184,186,189,191,193,196,198,200,203,205,208,210,213,
-    215,218,220,223,225,228,231,233,236,239,241,244,247,249,252,255 
-]
+    215,218,220,223,225,228,231,233,236,239,241,244,247,249,252,255
+))
+
+# Optionally, the rest of the quantisation can be disguised by dithering (see _apply_dithered_gamma()). For that, the
+# gamma-corrected values are kept to a fraction of a level: this is the same curve as above (gamma 2.8), but already
+# scaled to the final pixel brightness and in 256ths of a level rather than rounded
+DITHER_GAMMA_LOOKUP = array("H", (int(pow(i / 255, 2.8) * MAX_BRIGHTNESS * 256 + 0.5) for i in range(256)))
+# Amount added (in 256ths of a level) before rounding down, for each of every 4 neighbouring pixels - an ordered (Bayer)
+# dither, so that a colour in between two levels comes out as a mix of both across those pixels
+DITHER_OFFSETS = bytes((32, 160, 96, 224))
 
 
 class LedRing:
@@ -49,42 +72,95 @@ class LedRing:
     
     This class is a wrapper around the neopixel library that adds support for gamma correction, along with
     various lighting effects. It also prevent issues with interrupts when sending data to the neopixels.
+
+    Each instance uses one of the Pico's PIO state machines; call `release()` when finished with it to hand the state
+    machine back, so that another `LedRing` can be created in its place.
     """
 
-    _next_pio = 0
+    _free_pios = list(range(MAX_PIOS)) # IDs of the state machines not currently in use by any LedRing
 
-    def __init__(self, pin: int, led_count: int, offset: int = 0, enable_gamma: bool = True):
-        if LedRing._next_pio >= MAX_PIOS: raise IndexError("No more available state machines; cannot initialise LedRing")
-        self._pixels = Neopixel(led_count, LedRing._next_pio, pin, "GRB")
-        LedRing._next_pio += 1
+    def __init__(self, pin: int, led_count: int, offset: int = 0, enable_gamma: bool = True, dither: bool = False):
+        if not LedRing._free_pios: raise IndexError("No more available state machines; cannot initialise LedRing")
+        self._pio = LedRing._free_pios.pop(0)
+        self._pixels = Neopixel(led_count, self._pio, pin, "GRB")
         self.led_count = led_count
         self.offset = offset
+        self._dither = dither # Whether to dither the colours, see _apply_dithered_gamma()
+        # Actual pixel index for each position around the device, where position 0 is the LED directly above the USB port
+        # and positions increase clockwise; worked out once up front since the offset never changes
+        self._pixel_map = bytes((offset - i) % led_count for i in range(led_count))
         self._transition_start = 0
         self._transition_duration = 0
-        self._led_states = [(0, 0, 0)] * self.led_count
-        self._led_snapshot = [(0, 0, 0)] * self.led_count
-
-
+        # Pixel colours are stored as flat arrays of h, s, v values (3 per pixel) rather than lists of tuples, so that
+        # setting them doesn't allocate anything and crossfades can be blended in one go with integer maths
+        self._led_states = array("H", [0] * (led_count * 3))
+        self._led_snapshot = array("H", [0] * (led_count * 3))
+        self._led_blend = array("H", [0] * (led_count * 3)) # Working buffer for the blended colours during a transition
+        self.dirty = True # True if the pixels need refreshing, i.e. something has changed since the last update()
+        self._shown = False # False until the pixel buffer has been sent at least once (the pixels could be showing anything)
+        self._fill_colour = -1 # Packed hsv colour of the last set_colour() call, or -1 if any pixel has been set since
+        self._colour_cache = {} # Packed pixel word for each hsv colour converted recently, see update()
+        self._chroma_cache = {} # Full-brightness rgb colour for each hue and saturation converted recently, see _get_chroma()
+
+
+    @micropython.native # Runs every LED refresh, so worth compiling to machine code
     def update(self):
 
-        f = 1
+        # Nothing has changed since the last update, so the pixels are already showing the right thing
+        if not self.dirty: return
+
+        states = self._led_states
         
         if self.is_transition_active():
 
             elapsed = utime.ticks_ms() - self._transition_start
-            f = min(elapsed / self._transition_duration, 1)
+            # Progress through the transition as a fixed-point fraction of 256, so the blend needs no float maths
+            f = min((elapsed << 8) // self._transition_duration, 256)
 
-            if f == 1:
+            if f == 256:
                 # Transition finished, reset variables
                 self._transition_duration = 0
-
-        for i, led in enumerate(self._led_states):
-            # The following line mixes the current state with the snapshot state
-            hsv = [int(a * f + b * (1 - f)) for a, b in zip(led, self._led_snapshot[i])] # type: ignore
-            # Actually set the pixels
-            self._pixels.set_pixel(self._to_pixel_index(i), self._apply_gamma(hsv), how_bright = MAX_BRIGHTNESS)
-
-        self._refresh_pixels()
+            else:
+                # Mix the current state with the snapshot state
+                _blend(states, self._led_snapshot, self._led_blend, len(states), f)
+                states = self._led_blend
+
+        # Look these up once rather than for every pixel (local lookups are much quicker in MicroPython)
+        pixels = self._pixels.pixels # Not kept between updates since Neopixel.clear() replaces it
+        cache = self._colour_cache
+        # Gamma correction maps lots of low values to the same output (and the brightness scaling does the same again),
+        # so during slow fades many updates don't change anything visible; only send the data if they did
+        changed = not self._shown
+
+        # The effects only use a handful of colours at any one time, so rather than converting every pixel every update,
+        # the final word sent to the pixel (packed rgb, in the ring's byte order, with brightness applied) is cached for
+        # each hsv colour and written straight into the pixel buffer. The key packs the three channels into one int,
+        # which (unlike a tuple) doesn't need allocating.
+
+        if states is self._led_states and self._fill_colour >= 0 and not self._dither:
+            # The whole ring is one colour (from set_colour(), with no transition in progress), so only that one colour
+            # needs looking up, and the words can all be written in one go
+            key = self._fill_colour
+            word = cache.get(key)
+            if word is None: word = self._pack_colour(key, states[0], states[1], states[2])
+            if _fill_words(pixels, self.led_count, word): changed = True
+
+        else:
+            pixel_map = self._pixel_map
+            dither = self._dither
+            for i in range(self.led_count):
+                j = i * 3
+                p = pixel_map[i]
+                key = states[j] << 16 | states[j + 1] << 8 | states[j + 2]
+                if dither: key |= (i & 3) << 25 # Each of the dither offsets gives a different word
+                word = cache.get(key)
+                if word is None: word = self._pack_colour(key, states[j], states[j + 1], states[j + 2])
+                if word != pixels[p]:
+                    pixels[p] = word
+                    changed = True
+
+        if changed: self._refresh_pixels()
+        self.dirty = self.is_transition_active() # Transitions change the output every update until they finish
 
 
     def set_pixel(self, index: int, hsv):
@@ -92,14 +168,46 @@ class LedRing:
         Sets the pixel at the given index to the given colour, with gamma correction applied.
         An index of 0 corresponds to the pixel above the USB; indices increase moving clockwise.
         """
-        self._led_states[index] = hsv
+        j = index * 3
+        states = self._led_states
+        states[j] = int(hsv[0])
+        states[j + 1] = int(hsv[1])
+        states[j + 2] = int(hsv[2])
+        self._fill_colour = -1
+        self.dirty = True
+
+
+    def set_pixels(self, hsv_values, start: int = 0, stop: int = None):
+        """
+        Sets the pixels from start up to (but not including) stop to the colours in the given flat buffer of h, s, v
+        values for the whole ring (an array of type "H"), with gamma correction applied. Indices work as for
+        set_pixel().
+        """
+        if stop is None: stop = self.led_count
+        # Slicing the source would copy it into a new array every frame, so copy the values across directly instead
+        _copy(self._led_states, hsv_values, start * 3, stop * 3)
+        self._fill_colour = -1
+        self.dirty = True
 
 
     def set_colour(self, hsv):
         """
         Sets all pixels to the given colour, with gamma correction applied.
         """
-        self._led_states = [hsv] * self.led_count # How neat is that?
+        self.set_colour_hsv(int(hsv[0]), int(hsv[1]), int(hsv[2]))
+
+
+    def set_colour_hsv(self, h: int, s: int, v: int):
+        """
+        Equivalent to set_colour(), but takes the colour as separate ints so callers don't need to build a tuple.
+        """
+        # Effects such as the VU meter and the idle state tend to set the same colour over and over again, in which case
+        # there is nothing to do (and no need for another refresh)
+        colour = h << 16 | s << 8 | v
+        if colour == self._fill_colour: return
+        _fill(self._led_states, self.led_count, h, s, v)
+        self._fill_colour = colour
+        self.dirty = True
 
 
     def clear(self):
@@ -113,9 +221,21 @@ class LedRing:
         """
         Lights up the given fraction of the ring (clockwise from the back), with optional smoothing.
         """
-        self.clear()
-
-        f = fraction * self.led_count
+        n = self.led_count
+        # Work in fixed-point fractions of 256 pixels, so that only these few lines need any float maths
+        f = int(fraction * n * 256)
+        width = int(smoothing * 256)
+        half_width = width >> 1
+
+        # Near the top of the range every pixel is fully on, which is just a fill (and no change at all if the ring is
+        # already showing that colour, e.g. while the volume is held at maximum)
+        if f - half_width >= (n - 1) << 8:
+            self.set_colour(hsv)
+            return
+
+        # Unlit pixels keep the hue and saturation (rather than being cleared) so that crossfades to or from them don't
+        # pass through other hues
+        self.set_colour((hsv[0], hsv[1], 0))
 
         # Construct a (piecewise) function that is constant at 1 for some distance, followed by a ramp down
         # to 0, then constant zero, such that the function crosses 0.5 at f:
@@ -128,10 +248,13 @@ class LedRing:
         #   0        f-0.5s  f+0.5s      23
         #
         # If you work through the maths on this, it comes out as y = 0.5 + (f - x) / s, clamped to 0-1
+        # With everything in 256ths this becomes y = 128 + 256 * (f - x) / s, clamped to 0-256
         
-        for i in range(self.led_count):
-            y = max(0, min(1, 0.5 + (f - i) / smoothing))
-            self.set_pixel(i, (hsv[0], hsv[1], hsv[2] * y))
+        h, s, v = hsv
+        # Beyond f + 0.5s the function is zero, so those pixels are already set
+        for i in range(min(n, ((f + half_width) >> 8) + 1)):
+            y = max(0, min(256, 128 + ((f - (i << 8)) << 8) // width))
+            self.set_pixel(i, (h, s, v * y >> 8))
 
         # Old method
         # on_pixels = int(f)
@@ -167,15 +290,18 @@ class LedRing:
         """
         self._pixels.clear()
         if b:
+            set_pixel = self._pixels.set_pixel
+            led_count = self.led_count
             for n, val in enumerate(b):
+                if n >= len(BIT_ON_COLOURS): break # Only 3 colours (and only enough pixels for 3 bytes anyway)
+                on, off = BIT_ON_COLOURS[n], BIT_OFF_COLOURS[n]
                 for i in range(8):
                     pixel_index = n * 8 + i
-                    if pixel_index >= self.led_count: break # Run out of pixels!
-                    c = [0, 0, 0]
-                    c[n] = 255 if (val >> i) & 0b00000001 else 10 # Make the zeros dim rather than completely off
-                    self._pixels.set_pixel(pixel_index, c, MAX_BRIGHTNESS) # Don't modulate brightness for debug stuff
+                    if pixel_index >= led_count: break # Run out of pixels!
+                    set_pixel(pixel_index, on if (val >> i) & 0b00000001 else off, MAX_BRIGHTNESS) # Don't modulate brightness for debug stuff
 
         self._refresh_pixels()
+        self.dirty = True # The pixels no longer match the stored states, so the next update() should put them back
 
 
     def crossfade(self, t: int):
@@ -187,7 +313,31 @@ class LedRing:
         if self.is_transition_active(): return # Ignore multiple requests
         self._transition_start = utime.ticks_ms()
         self._transition_duration = t
-        self._led_snapshot = self._led_states.copy() # Shallow copy should be okay since we never modify hsv components in here
+        self._led_snapshot[:] = self._led_states # Copies the values across, no allocation needed
+        self.dirty = True
+
+
+    def flash(self, hsv, t: int):
+        """
+        Sets all pixels to the given colour, then immediately starts a crossfade from that colour to whatever new state
+        is set over t milliseconds, giving a flash effect. Equivalent to calling `set_colour()` then `crossfade()`.
+        """
+        self.set_colour(hsv)
+        if self.is_transition_active(): return # Same as crossfade(), ignore multiple requests
+        self._transition_start = utime.ticks_ms()
+        self._transition_duration = t
+        self._led_snapshot[:] = self._led_states
+        self.dirty = True # set_colour() leaves the flag alone if the colour didn't change, so set it here too
+
+
+    def release(self):
+        """
+        Stops this LED ring's state machine and makes it available again. The LED ring can't be used after this.
+        """
+        if self._pio is None: return # Already released
+        self._pixels.sm.active(0)
+        LedRing._free_pios.append(self._pio)
+        self._pio = None
 
 
     def is_transition_active(self) -> bool:
@@ -205,25 +355,153 @@ class LedRing:
         """
         # Sending data to the NeoPixels is timing critical, therefore it MUST NOT be interrupted or the LED drivers
         # will interpret the incomplete data, resulting in the wrong pixels turning on
+        # That said, interrupts are also what keeps the encoder count up to date, so they should be disabled for as
+        # short a time as possible: all the colour calculations happen beforehand (in update()), and even the method
+        # lookup is done before disabling them, so that ONLY the transmission itself happens with interrupts off.
+        # (Re-enabling interrupts partway through isn't an option either - if the data stops for longer than the
+        # WS2812 reset time while an interrupt is handled, the pixels latch a partial frame.)
+        show = self._pixels.show
         state = machine.disable_irq()
-        self._pixels.show()
+        show()
         machine.enable_irq(state)
+        self._shown = True
 
 
-    def _to_pixel_index(self, index: int) -> int:
+    def _pack_colour(self, key: int, h: int, s: int, v: int) -> int:
         """
-        Returns the actual pixel index corresponding to the given position around the device, where an input index of 0
-        corresponds to the LED directly above the USB port and indices increase clockwise around the device.
+        Converts the given hsv colour (as separate ints) to the word sent to the pixels, with gamma correction and
+        brightness applied, and adds it to the colour cache under the given key.
         """
-        if index > 23 or index < 0: raise ValueError(f"Invalid pixel index: {index}")
-        return (self.offset - index) % self.led_count
-
-
-    def _apply_gamma(self, hsv) -> tuple[int, int, int]:
+        # Let the library do the packing, then read back the result (leaving the pixel as it was)
+        pixels = self._pixels.pixels
+        old = pixels[0]
+        if self._dither:
+            # Dithered colours already have the brightness applied; the dither position is in the top bits of the key
+            self._pixels.set_pixel(0, self._apply_dithered_gamma(h, s, v, key >> 25), 255)
+        else:
+            self._pixels.set_pixel(0, self._apply_gamma(h, s, v), MAX_BRIGHTNESS)
+        word = pixels[0]
+        pixels[0] = old
+        # Evicting entries individually isn't worth the bookkeeping, so the whole cache is simply emptied if it fills up
+        # (e.g. during a long crossfade); it soon fills back up with the colours in use
+        if len(self._colour_cache) >= COLOUR_CACHE_SIZE: self._colour_cache.clear()
+        self._colour_cache[key] = word
+        return word
+
+
+    def _apply_gamma(self, h: int, s: int, v: int) -> tuple[int, int, int]:
         """
-        Applies gamma correction to the given hsv colour and returns it as an rgb colour.
+        Applies gamma correction to the given hsv colour (as separate ints) and returns it as an rgb colour.
         """
-        if len(hsv) != 3: raise ValueError("Unexpected colour format; must be a sequence of exactly 3 ints")
+        base = self._get_chroma(h, s)
         # Apply gamma correction to the value channel before converting to RGB
         # This should give natural-looking results whilst being very cheap and simple to implement
-        return self._pixels.colorHSV(int(hsv[0]/360 * 65535), hsv[1], GAMMA_LOOKUP[int(hsv[2])])
\ No newline at end of file
+        v1 = 1 + GAMMA_LOOKUP[v]
+        return base[0] * v1 >> 8, base[1] * v1 >> 8, base[2] * v1 >> 8
+
+
+    def _apply_dithered_gamma(self, h: int, s: int, v: int, position: int) -> tuple[int, int, int]:
+        """
+        Applies gamma correction and brightness to the given hsv colour (as separate ints) and returns it as an rgb
+        colour, dithered according to the given position (0-3) in the dither pattern.
+        """
+        # At MAX_BRIGHTNESS there are only a handful of output levels at the dim end, so a slow fade visibly steps from
+        # one to the next. Rounding neighbouring pixels up or down by different amounts means a value in between two
+        # levels lights some of them at each, which the diffuser blends into something close to the true value.
+        base = self._get_chroma(h, s)
+        g = DITHER_GAMMA_LOOKUP[v]
+        offset = DITHER_OFFSETS[position]
+        return (base[0] * g // 255 + offset) >> 8, (base[1] * g // 255 + offset) >> 8, (base[2] * g // 255 + offset) >> 8
+
+
+    def _get_chroma(self, h: int, s: int) -> tuple[int, int, int]:
+        """
+        Returns the full-brightness rgb colour for the given hue and saturation.
+        """
+        # _hsv_to_rgb() works out the full-brightness colour from the hue and saturation, then scales each channel by
+        # (1 + value) >> 8 - so that colour can be kept and reused for any value. Fades, fractions and the like only
+        # change the value, so they need just a scaling rather than a full conversion for every new colour.
+        # (Fully converted colours are cached as well, in update().)
+        key = h << 8 | s
+        base = self._chroma_cache.get(key)
+        if base is None:
+            base = _hsv_to_rgb(HUE_LOOKUP[h % 360], s, 255) # 1 + 255 = 256, so no scaling
+            if len(self._chroma_cache) >= CHROMA_CACHE_SIZE: self._chroma_cache.clear()
+            self._chroma_cache[key] = base
+        return base
+
+
+### Internal functions ###
+
+@micropython.viper
+def _blend(a: ptr16, b: ptr16, out: ptr16, n: int, f: int):
+    """
+    [Internal] Linearly interpolates between the first n values in a and b, writing the results into out. The weighting
+    f is a fixed-point fraction of 256, where 256 gives all a and 0 gives all b.
+    """
+    # Viper compiles this to plain integer machine code, so there are no int objects allocated for the intermediate values
+    g = 256 - f
+    for i in range(n):
+        out[i] = (a[i] * f + b[i] * g) >> 8
+
+
+@micropython.viper
+def _fill_words(words: ptr32, n: int, word: int) -> bool:
+    """
+    [Internal] Sets the first n words in the given buffer to the given value. Returns True if any of them changed.
+    """
+    changed = False
+    for i in range(n):
+        if words[i] != word:
+            words[i] = word
+            changed = True
+    return changed
+
+@micropython.viper
+def _copy(dest: ptr16, src: ptr16, start: int, stop: int):
+    """
+    [Internal] Copies the values from start up to (but not including) stop from src into the same positions in dest.
+    """
+    for i in range(start, stop):
+        dest[i] = src[i]
+
+@micropython.viper
+def _fill(states: ptr16, n: int, h: int, s: int, v: int):
+    """
+    [Internal] Sets the first n pixels in the given flat buffer of h, s, v values to the given colour.
+    """
+    for j in range(0, n * 3, 3):
+        states[j] = h
+        states[j + 1] = s
+        states[j + 2] = v
+
+
+@micropython.native
+def _hsv_to_rgb(hue: int, sat: int, val: int) -> tuple[int, int, int]:
+    """
+    [Internal] Converts the given hsv colour to an rgb colour, where the hue is in the 16-bit range (0-65535) and the
+    saturation and value are 0-255. This gives exactly the same results as Neopixel.colorHSV(), but it's compiled to
+    machine code rather than running in the bytecode interpreter.
+    """
+    # Same integer-only algorithm as the library: the hue is scaled to 0-1529, i.e. six 255-step segments around the
+    # colour wheel, each of which ramps one channel up or down while the other two are held at 0 and 255
+    hue = ((hue % 65536) * 1530 + 32768) >> 16
+    if hue < 510:
+        b = 0
+        if hue < 255: r = 255; g = hue
+        else: r = 510 - hue; g = 255
+    elif hue < 1020:
+        r = 0
+        if hue < 765: g = 255; b = hue - 510
+        else: g = 1020 - hue; b = 255
+    elif hue < 1530:
+        g = 0
+        if hue < 1275: r = hue - 1020; b = 255
+        else: r = 255; b = 1530 - hue
+    else:
+        r = 255; g = 0; b = 0
+    # Then apply saturation and value
+    v1 = 1 + val
+    s1 = 1 + sat
+    s2 = 255 - sat
+    return ((((r * s1) >> 8) + s2) * v1) >> 8, ((((g * s1) >> 8) + s2) * v1) >> 8, ((((b * s1) >> 8) + s2) * v1) >> 8
\ No newline at end of file
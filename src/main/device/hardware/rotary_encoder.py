@@ -3,6 +3,16 @@ from machine import Pin
 
 micropython.alloc_emergency_exception_buf(100) # Recommended when using interrupts
 
+# Change in count for each transition between pin states, indexed by (previous state << 2) | new state, where each state
+# is (A << 1) | B. Stored plus 1, since bytes can't be negative. Transitions where both pins changed at once (i.e. an edge
+# was missed) are ambiguous so they count as 0, as do 'transitions' where nothing changed.
+TRANSITION_DELTAS = bytes((
+    1, 0, 2, 1, # From 00
+    2, 1, 1, 0, # From 01
+    0, 1, 1, 2, # From 10
+    1, 2, 0, 1  # From 11
+))
+
 class Encoder:
     """
     Class representing a quadrature rotary encoder with pushbutton.
@@ -23,17 +33,17 @@ class Encoder:
         self.pin_b = Pin(pin_b, Pin.IN, Pin.PULL_UP)
         self.pin_sw = Pin(pin_sw, Pin.IN, Pin.PULL_UP)
 
-        # Interrupts
-        self.pin_a.irq(self.handle_pulse, Pin.IRQ_RISING | Pin.IRQ_FALLING)
-        self.pin_b.irq(self.handle_pulse, Pin.IRQ_RISING | Pin.IRQ_FALLING)
-
         # Init other variables
         self.cpr = ppr * 4
         self.count = 0
-        self._last_pulse_pin = self.pin_a
-        self._last_pulse_val = 0
+        self._state = self.pin_a.value() << 1 | self.pin_b.value() # Pin states as of the last pulse, (A << 1) | B
+
+        # Interrupts (set up last, since the handler needs the variables above)
+        self.pin_a.irq(self.handle_pulse, Pin.IRQ_RISING | Pin.IRQ_FALLING)
+        self.pin_b.irq(self.handle_pulse, Pin.IRQ_RISING | Pin.IRQ_FALLING)
 
     
+    @micropython.native # Called on every edge, so worth compiling to machine code
     def handle_pulse(self, pin: Pin):
         """
         Interrupt handler for this encoder (internal); called each time the value of pin A or B changes.
@@ -41,18 +51,13 @@ class Encoder:
         Parameters:
         - pin: The pin that changed
         """
-        pin_val = pin.value() # Capture value of the tiggered pin as soon as possible in case it changes
-
-        is_pin_b = pin is self.pin_b
-        other_pin_val = self.pin_a.value() if is_pin_b else self.pin_b.value()
-
-        if self._last_pulse_pin is pin and self._last_pulse_val == pin_val: return # Ignore if the same pin was pulsed twice
-
-        self._last_pulse_pin = pin # Update last pulsed pin
-        self._last_pulse_val = pin_val
-
-        delta = 1 if is_pin_b == (pin_val == other_pin_val) else -1
-        self.count = (self.count + delta) % self.cpr
+        # Rather than working out what happened from which pin triggered the interrupt, read both pins and look up the
+        # transition from the previous state. Contact bounce then cancels itself out (each bounce steps the count back
+        # and forth between the same two values), and a repeated or late interrupt just sees no change.
+        state = self.pin_a.value() << 1 | self.pin_b.value()
+        delta = TRANSITION_DELTAS[self._state << 2 | state] - 1
+        self._state = state
+        if delta: self.count = (self.count + delta) % self.cpr
 
 
     def is_switch_pressed(self):
@@ -7,11 +7,11 @@ Note that, unlike implementations in some other projects, the states here don't
 This is simply because in this application, state changes don't usually happen from within state logic - most happen
 'asynchronously' on receipt of messages.
 
-Another difference is that a new state is created each transition, since there are variables that need resetting, and unlike C++,
-Python has a garbage collector to deal with the old state objects for us :P
+Another difference is that there is only ever one instance of each state, which is reused every time that state is entered
+(enter() resets its variables), so that changing state doesn't leave old state objects behind for the garbage collector.
 """
 
-import utime
+from utime import ticks_ms
 
 from constants import *
 
@@ -19,21 +19,38 @@ import device_logger as log
 import device_controller as device
 import message_protocol as msp
 
+# The states use these every update, so they're looked up once here rather than through the device controller each time
+# (the serial manager is only created after this module is imported, so that one still has to go through device)
+leds = device.leds
+encoder = device.encoder
+
 class State:
     """
     Base class for device states.
     """
 
-    def __init__(self):
+    _instance = None # The one instance of each state class, see instance()
+
+    @classmethod
+    def instance(cls):
+        """
+        Returns the instance of this state, creating it the first time.
+        """
+        if cls._instance is None: cls._instance = cls()
+        return cls._instance
+
+    def enter(self):
         """
-        Constructs a new instance of this state.
+        Called each time the device switches to this state, to reset it. States that need any information from whatever
+        caused the switch take it as arguments here (passed on by set_state()).
         """
         pass
 
     def should_display_audio(self) -> bool:
         """
         Called to determine whether the device should display audio visualisations in the current state.
-        This need not return a constant; this behaviour may change within a single state.
+        This is only called when the state is entered (the result is cached in display_audio), so it must not change
+        while the state is active.
         """
         return False # Default to not displaying audio visualisations
 
@@ -48,22 +65,25 @@ class StartupState(State):
     """
     Class representing the state of the device before connection has been established with the host program.
     """
-    def __init__(self):
-        device.leds.clear()
-        self.last_broadcast_time = utime.ticks_ms()
+    def enter(self):
+        leds.clear()
+        self.last_broadcast_time = ticks_ms()
 
     def update(self):
 
+        now = ticks_ms()
+
         # Send regular device ID messages
-        if utime.ticks_ms() - self.last_broadcast_time > BROADCAST_INTERVAL:
-            self.last_broadcast_time = utime.ticks_ms()
+        if now - self.last_broadcast_time > BROADCAST_INTERVAL:
+            self.last_broadcast_time = now
             device.serial_manager.send(msp.IDMessage(DEVICE_TYPE_ID))
         
-        rotation = int(PIXEL_COUNT * utime.ticks_ms() / STARTUP_ANIMATION_PERIOD) % PIXEL_COUNT
+        rotation = int(PIXEL_COUNT * now / STARTUP_ANIMATION_PERIOD) % PIXEL_COUNT
 
+        set_pixel = leds.set_pixel
         for i in range(PIXEL_COUNT):
             brightness = max(0, 1 - ((rotation - i) % PIXEL_COUNT) / STARTUP_ANIMATION_FADE_LENGTH)
-            device.leds.set_pixel(i, hsv = (STARTUP_COLOUR[0], STARTUP_COLOUR[1], STARTUP_COLOUR[2] * brightness))
+            set_pixel(i, (STARTUP_COLOUR[0], STARTUP_COLOUR[1], STARTUP_COLOUR[2] * brightness))
 
 
 class IdleState(State):
@@ -73,23 +93,22 @@ class IdleState(State):
     # N.B. for simplicity, when it comes to implementing the VU meter this will NOT be done as a separate state because
     # that would result in extra complexity with the other states knowing which state to return to when they are done.
     # Instead, it should be implemented as a simple if statement and a bool to keep track of the playback status.
-    # Edit: Then again, now we're creating state objects each time we could feasibly store a prev_state to go back to...
 
-    def __init__(self):
-        self.initial_encoder_count = device.encoder.count # Used to detect when the knob has been rotated
-        device.leds.clear() # Turn off pixels to begin with
-        #device.leds.set_colour((90, 255, 255)) # Green
+    def enter(self):
+        self.initial_encoder_count = encoder.count # Used to detect when the knob has been rotated
+        leds.clear() # Turn off pixels to begin with
+        #leds.set_colour((90, 255, 255)) # Green
 
     def should_display_audio(self):
         return True # Always display audio when idle
 
     def update(self):
 
-        if device.encoder.is_switch_pressed():
-            set_state(PressedState())
+        if encoder.is_switch_pressed():
+            set_state(PressedState)
             return
 
-        if abs(device.encoder.count - self.initial_encoder_count) > ENCODER_DEADZONE:
+        if abs(encoder.count - self.initial_encoder_count) > ENCODER_DEADZONE:
             device.serial_manager.send(msp.VolumeRequestMessage())
             return
 
@@ -99,27 +118,28 @@ class VolumeAdjustState(State):
     Class representing the state of the device while the volume is being adjusted.
     """
 
-    def __init__(self, initial_volume):
+    def enter(self, initial_volume):
         self.volume = initial_volume
-        self.idle_start_time = utime.ticks_ms()
-        self.prev_count = device.encoder.count # Used to detect when the knob has been rotated
-        device.leds.display_fraction(self.volume, VOL_DISPLAY_COLOUR)
+        self.idle_start_time = ticks_ms()
+        self.prev_count = encoder.count # Used to detect when the knob has been rotated
+        leds.display_fraction(self.volume, VOL_DISPLAY_COLOUR)
 
     def update(self):
 
-        if device.encoder.is_switch_pressed():
-            set_state(PressedState())
+        if encoder.is_switch_pressed():
+            set_state(PressedState)
             return
 
-        if device.encoder.count == self.prev_count:
-            elapsed = utime.ticks_ms() - self.idle_start_time
+        count = encoder.count
+        if count == self.prev_count:
+            elapsed = ticks_ms() - self.idle_start_time
             if elapsed > VOL_DISPLAY_HOLD_TIME:
-                device.leds.crossfade(LED_TRANSITION_DURATION)
-                set_state(IdleState()) # Knob stationary for long enough, return to idle
+                leds.crossfade(LED_TRANSITION_DURATION)
+                set_state(IdleState) # Knob stationary for long enough, return to idle
                 return
         else:
             # Calculate change in encoder count since the last update, wrapping to the -180 to 180 degree range
-            delta = encoder_delta(self.prev_count, device.encoder.count)
+            delta = encoder_delta(self.prev_count, count)
             
             prev_vol = self.volume # Record previous volume level for comparison later
             self.volume += delta / (ENCODER_PPR * 4) # Update internal volume variable
@@ -128,10 +148,10 @@ class VolumeAdjustState(State):
                 msg = msp.VolumeMessage(self.volume)
                 device.serial_manager.send(msg)
 
-            self.idle_start_time = utime.ticks_ms() # Knob moved, reset idle timer
+            self.idle_start_time = ticks_ms() # Knob moved, reset idle timer
         
-        device.leds.display_fraction(self.volume, VOL_DISPLAY_COLOUR) # Update displayed volume
-        self.prev_count = device.encoder.count
+        leds.display_fraction(self.volume, VOL_DISPLAY_COLOUR) # Update displayed volume
+        self.prev_count = count
 
 
 class PressedState(State):
@@ -139,27 +159,26 @@ class PressedState(State):
     Class representing the state of the device while the button is pressed down, an intermediate state for several controls.
     """
 
-    def __init__(self):
-        self.hold_start_time = utime.ticks_ms()
-        self.initial_encoder_count = device.encoder.count
+    def enter(self):
+        self.hold_start_time = ticks_ms()
+        self.initial_encoder_count = encoder.count
         self.like_msg_sent = False
-        #device.leds.set_colour((240, 255, 255)) # Blue
+        #leds.set_colour((240, 255, 255)) # Blue
 
     def should_display_audio(self):
         return True # Always display audio when pressed for now
 
     def update(self):
 
-        like_time_exceeded = utime.ticks_ms() - self.hold_start_time > LIKE_HOLD_TIME
+        like_time_exceeded = ticks_ms() - self.hold_start_time > LIKE_HOLD_TIME
         
-        if not device.encoder.is_switch_pressed(): # Button released
+        if not encoder.is_switch_pressed(): # Button released
         
             if not like_time_exceeded:
-                device.leds.set_colour(PLAY_PAUSE_COLOUR)
-                device.leds.crossfade(LED_ANIMATION_DURATION)
+                leds.flash(PLAY_PAUSE_COLOUR, LED_ANIMATION_DURATION)
                 device.serial_manager.send(msp.TogglePlaybackMessage()) # Short press: send play/pause message
 
-            set_state(IdleState()) # Return to idle as soon as the button is released, regardless of hold duration
+            set_state(IdleState) # Return to idle as soon as the button is released, regardless of hold duration
             return
         
         # Long press: send like/unlike message
@@ -169,8 +188,8 @@ class PressedState(State):
             device.serial_manager.send(msp.LikeMessage())
             self.like_msg_sent = True
         
-        if abs(encoder_delta(self.initial_encoder_count, device.encoder.count)) > ENCODER_DEADZONE:
-            set_state(SkippingState(self.initial_encoder_count))
+        if abs(encoder_delta(self.initial_encoder_count, encoder.count)) > ENCODER_DEADZONE:
+            set_state(SkippingState, self.initial_encoder_count)
             return # Good practice even when it's the end of the method
         
 
@@ -179,22 +198,23 @@ class UnlikeAnimationState(State):
     Class representing the state of the device while the unlike animation is playing.
     """
 
-    def __init__(self):
-        self.start_time = utime.ticks_ms()
+    def enter(self):
+        self.start_time = ticks_ms()
 
     def update(self):
 
-        progress = (utime.ticks_ms() - self.start_time) / LED_ANIMATION_DURATION
+        progress = (ticks_ms() - self.start_time) / LED_ANIMATION_DURATION
 
-        if progress > 1 and not device.encoder.is_switch_pressed(): # Button released
-            set_state(IdleState())
-            device.leds.crossfade(LED_TRANSITION_DURATION)
+        if progress > 1 and not encoder.is_switch_pressed(): # Button released
+            set_state(IdleState)
+            leds.crossfade(LED_TRANSITION_DURATION)
             return
         
+        set_pixel = leds.set_pixel
         for i in range(PIXEL_COUNT):
             brightness = min(1, max(0, abs(i/PIXEL_COUNT - 0.5) * 2 + 0.2 - progress**0.5) * 3) # sqrt progress so it starts fast
             hsv = (UNLIKE_COLOUR[0], UNLIKE_COLOUR[1], UNLIKE_COLOUR[2] * brightness)
-            device.leds.set_pixel(i, hsv)
+            set_pixel(i, hsv)
 
 
 class SkippingState(State):
@@ -202,31 +222,35 @@ class SkippingState(State):
     Class representing the state of the device while a track is being skipped.
     """
 
-    def __init__(self, initial_encoder_count):
+    def enter(self, initial_encoder_count):
         self.idle_time = 0
         self.initial_encoder_count = initial_encoder_count
-        #device.leds.set_colour((300, 255, 255)) # Magenta
+        #leds.set_colour((300, 255, 255)) # Magenta
 
     def update(self):
 
-        delta = encoder_delta(self.initial_encoder_count, device.encoder.count)
+        delta = encoder_delta(self.initial_encoder_count, encoder.count)
 
-        device.leds.display_dir_indicator(delta / 20, 200, 180)
+        leds.display_dir_indicator(delta / 20, 200, 180)
 
-        if not device.encoder.is_switch_pressed(): # Button released
+        if not encoder.is_switch_pressed(): # Button released
             
             if abs(delta) > ENCODER_DEADZONE:
                 device.serial_manager.send(msp.SkipMessage(delta > 0))
-                device.leds.display_dir_indicator(2.5 if delta > 0 else -2.5, 0, 0)
+                leds.display_dir_indicator(2.5 if delta > 0 else -2.5, 0, 0)
             
-            device.leds.crossfade(LED_ANIMATION_DURATION)
-            set_state(IdleState())
+            leds.crossfade(LED_ANIMATION_DURATION)
+            set_state(IdleState)
             return
 
 
 ### Globals ###
 
-_current_state = StartupState()
+_current_state = StartupState.instance()
+_current_state.enter()
+# Whether the current state displays audio, cached here so the audio handlers (which run for every frame of audio)
+# can check a plain attribute rather than calling get_current_state().should_display_audio() every time
+display_audio = _current_state.should_display_audio()
 
 def encoder_delta(old_count: int, new_count: int) -> int:
     """
@@ -238,14 +262,18 @@ def encoder_delta(old_count: int, new_count: int) -> int:
     return delta
 
 
-def set_state(new_state):
+def set_state(state: type[State], *args):
     """
-    Switches the device to the given state.
+    Switches the device to the given state. Any additional arguments are passed on to the state's enter() method.
+    Switching to the state the device is already in enters it again, resetting it.
     """
-    global _current_state
-    if new_state == _current_state: return
-    log.debug(f"Entering state: {type(new_state).__name__}")
+    global _current_state, display_audio
+    new_state = state.instance()
+    new_state.enter(*args)
+    # The message is only formatted in debug builds; optimised builds drop this line entirely (see device_logger)
+    if __debug__: log.debug(f"Entering state: {state.__name__}")
     _current_state = new_state
+    display_audio = new_state.should_display_audio()
 
 
 def is_in_state(state: type[State]):
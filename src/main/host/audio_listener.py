@@ -49,19 +49,38 @@ class AudioListener():
         # Logarithmic frequency bins (20Hz - 4kHz seems pretty good)
         self.frequency_bins = [(2 * 10**n) for n in np.linspace(1, 3.3, SPECTRUM_FREQUENCY_BINS + 1)]
 
-        self.sample_frequencies = np.fft.rfftfreq(AUDIO_SAMPLES_PER_FRAME * ROLLING_FRAMES, 1/AUDIO_SAMPLE_RATE)
+        self.sample_frequencies = np.fft.rfftfreq(FFT_LENGTH, 1/AUDIO_SAMPLE_RATE)
         # Quantise transform frequencies into bins
         self.freq_bin_indices = np.digitize(self.sample_frequencies, self.frequency_bins)
+        # Since the frequencies are in ascending order, each bin is a contiguous slice of the transform, so we only
+        # need to know where each one starts (and where the last one ends) to reduce them all in one go
+        self.freq_bin_starts = np.searchsorted(self.freq_bin_indices, np.arange(1, SPECTRUM_FREQUENCY_BINS + 1))
+        self.freq_bin_end = np.searchsorted(self.freq_bin_indices, SPECTRUM_FREQUENCY_BINS + 1)
+
+        # The FFT length never changes, so the window function only needs calculating once
+        self.fft_window = np.hanning(FFT_LENGTH)
 
         # Init arrays
-        self.prev_samples = np.zeros([AUDIO_SAMPLES_PER_FRAME * ROLLING_FRAMES, 2])
+        self.prev_samples = np.zeros([FFT_LENGTH, 2])
         self.prev_hist_data = np.zeros((AUDIO_AVERAGING_WINDOW, SPECTRUM_FREQUENCY_BINS))
+        # The spectrum as the device will have reconstructed it, for working out the next set of deltas
+        self.sent_levels = bytearray(SPECTRUM_FREQUENCY_BINS * 2)
+        self.frames_since_keyframe = SPECTRUM_KEYFRAME_INTERVAL # Start with a keyframe
 
         # Blank variables for later
         self.mic = None
         self.rec = None
 
     
+    def reset(self):
+        """
+        Resets the record of what the device's spectrum looks like. Must be called whenever the device (re)connects,
+        since it starts again from an empty spectrum, so the next spectrum sent must be a keyframe.
+        """
+        self.sent_levels[:] = bytes(len(self.sent_levels))
+        self.frames_since_keyframe = SPECTRUM_KEYFRAME_INTERVAL
+
+
     def __enter__(self):
         pass # Mic gets opened later
 
@@ -93,7 +112,7 @@ class AudioListener():
             self.mic = sc.get_microphone(speaker_id, include_loopback = True)
             log.info("Microphone updated to %s", self.mic)
             self._finalise_recorder() # Manually exit recorder before reinitialising
-            self.rec = self.mic.recorder(samplerate = 48000)
+            self.rec = self.mic.recorder(samplerate = AUDIO_SAMPLE_RATE)
             self.rec.__enter__()
 
         
@@ -106,15 +125,15 @@ class AudioListener():
         if self.rec is None: return
 
         try:
-            data = self.rec.record(numframes = 1024)
+            data = self.rec.record(numframes = AUDIO_SAMPLES_PER_FRAME)
         except RuntimeError as e:
             log.log(TRACE, "Unable to record audio (error code %s)", e)
             return
         
         ### Simple VU Meter ###
         
-        # left = min(float(np.max(data[:, 0])) * 5.0, 1)
-        # right = min(float(np.max(data[:, 1])) * 5.0, 1)
+        # left = int(min(float(np.max(data[:, 0])) * 5.0, 1) * 255)
+        # right = int(min(float(np.max(data[:, 1])) * 5.0, 1) * 255)
 
         # serial_manager.send(msp.VUMessage(left, right))
 
@@ -123,9 +142,10 @@ class AudioListener():
         self.prev_samples = np.row_stack([self.prev_samples[AUDIO_SAMPLES_PER_FRAME:, :], data])
 
         mono = np.max(self.prev_samples, axis = 1)
-        amps = np.abs(np.fft.rfft(mono * np.hanning(len(mono)))) # Apply Hanning window before FFT to combat spectral leakage
+        amps = np.abs(np.fft.rfft(mono * self.fft_window)) # Apply Hanning window before FFT to combat spectral leakage
 
-        amps_binned = np.array([np.max(amps[np.where(self.freq_bin_indices == i+1)]) for i in range(SPECTRUM_FREQUENCY_BINS)])
+        # Peak amplitude within each frequency bin
+        amps_binned = np.maximum.reduceat(amps[:self.freq_bin_end], self.freq_bin_starts)
         amps_binned = np.nan_to_num(amps_binned)
 
         # Shift prev samples up 1, discard the oldest and append the current sample
@@ -133,6 +153,28 @@ class AudioListener():
         # Calculate average across frames
         freq_avg = np.sum(self.prev_hist_data * self.window_weights, axis = 0) / sum(self.window_weights)
 
-        freq_normalised = [min(0.02 * v / media_manager.get_volume(True), 1) for v in freq_avg] # Normalise to 0-1 range
+        # Normalise to 0-1 range and quantise to bytes for sending, all in one vectorised operation
+        levels = np.clip(freq_avg * (0.02 * 255 / media_manager.get_volume(True)), 0, 255).astype(np.uint8).tobytes()
 
-        serial_manager.send(msp.SpectrumMessage(freq_normalised, freq_normalised))
\ No newline at end of file
+        serial_manager.send(self._encode_spectrum(levels, levels))
+
+
+    def _encode_spectrum(self, left: bytes, right: bytes) -> msp.Message:
+        """
+        [Internal] Returns the message to send for the given spectrum: a `SpectrumDeltaMessage` relative to the
+        previously sent spectrum if possible, otherwise a full `SpectrumMessage` as a keyframe.
+        """
+        target = np.frombuffer(left + right, dtype = np.uint8).astype(np.int16)
+        prev = np.frombuffer(self.sent_levels, dtype = np.uint8).astype(np.int16)
+        deltas = np.round((target - prev) / SPECTRUM_DELTA_STEP)
+
+        self.frames_since_keyframe += 1
+        # Send a keyframe periodically (in case a message got lost) and whenever the deltas can't keep up
+        if self.frames_since_keyframe >= SPECTRUM_KEYFRAME_INTERVAL or np.any(deltas < -8) or np.any(deltas > 7):
+            self.frames_since_keyframe = 0
+            self.sent_levels[:] = left + right
+            return msp.SpectrumMessage(left, right)
+
+        msg = msp.SpectrumDeltaMessage(deltas)
+        msg.apply(self.sent_levels) # Track the spectrum exactly as the device will reconstruct it
+        return msg
\ No newline at end of file
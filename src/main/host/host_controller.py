@@ -203,6 +203,7 @@ class HostController:
                     with self.serial_manager:
 
                         connect_success = True
+                        self.audio_listener.reset() # Device spectrum starts from scratch, so resync with a keyframe
                         self._post_event(Event.DEVICE_CONNECT)
                         log.info("Device connection successful")
 
@@ -213,6 +214,7 @@ class HostController:
                         while self.exit_flag == ExitFlag.NONE:
                             self.serial_manager.update()
                             self.audio_listener.update(self.serial_manager, self.media_manager)
+                            self.serial_manager.flush() # Send everything from this cycle in one go
                             if i == 0:
                                 i = 1000
                                 elapsed = time.perf_counter() - t
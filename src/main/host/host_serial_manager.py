@@ -21,7 +21,8 @@ import message_protocol as msp
 MESSAGE_LOG_BLACKLIST = [
     msp.LogMessage,
     msp.VUMessage,
-    msp.SpectrumMessage
+    msp.SpectrumMessage,
+    msp.SpectrumDeltaMessage
 ]
 
 
@@ -73,6 +74,8 @@ class HostSerialManager(SerialManager):
         super().__init__()
         log.info("Initialising serial manager")
         self.serial_connection = None
+        self.send_queue = [] # Outgoing messages, written together once per tick by flush()
+        self.rx_pending = b"" # Received bytes belonging to a message that hasn't fully arrived yet
 
     # Override to add logging
     def register_handler(self, message_type: type, handler):
@@ -80,8 +83,32 @@ class HostSerialManager(SerialManager):
         log.debug("Registered new handler for %s", message_type)
 
     
+    # Override to read everything that's waiting in one go, rather than making two reads for every message
+    def update(self):
+        if not self.serial_connection: return
+        n = self.serial_connection.in_waiting
+        if not n: return
+        log.log(TRACE, "Reading %i bytes", n)
+        data = self.rx_pending + self.serial_connection.read(n)
+        view = memoryview(data)
+        # Split the data into messages using the size of each message type
+        offset = 0
+        while offset < len(data):
+            id = data[offset]
+            if id >= len(msp.MESSAGE_SIZES): raise IndexError("Invalid message ID!")
+            end = offset + 1 + msp.MESSAGE_SIZES[id]
+            if end > len(data): break # The rest of this message hasn't arrived yet
+            msg = msp.msg_from_id(id)
+            msg.decode(view[offset + 1:end])
+            self.handle(msg, view[offset:end])
+            offset = end
+        self.rx_pending = data[offset:]
+
+    
     def handle(self, msg: msp.Message, raw: bytes):
-        if type(msg) not in MESSAGE_LOG_BLACKLIST:
+        # Only format the raw bytes if they are actually going to be logged (raw is a view of the receive buffer so
+        # passing it in costs nothing otherwise)
+        if type(msg) not in MESSAGE_LOG_BLACKLIST and log.getLogger().isEnabledFor(log.DEBUG):
             log.debug("Received %s (raw bytes: %s)", msg, self._format_bytes(raw))
         super().handle(msg, raw)
 
@@ -110,7 +137,7 @@ class HostSerialManager(SerialManager):
         ##### Required
         - `com_port`: The name of the COM port to connect to, e.g. `"COM3"`.
         ##### Optional
-        - `baud_rate`: The baud rate to use for the connection. Defaults to `115200`.
+        - `baud_rate`: The baud rate to use for the connection. Defaults to `BAUD_RATE`.
 
         ---
         Once this method returns, `self.serial_connection` will contain the active `Serial` object if successful,
@@ -120,6 +147,7 @@ class HostSerialManager(SerialManager):
         log.debug("Attempting to initialise serial connection on %s at %i baud", com_port, baud_rate)
         try:
             self.serial_connection = serial.Serial(com_port, baud_rate, timeout = CONNECTION_TIMEOUT, write_timeout = CONNECTION_TIMEOUT)
+            self._set_low_latency()
         except SerialException:
             # There may be a case in which we're trying to connect to the wrong Pico and for some reason it won't
             # connect (e.g. it's already in use by some other program) - in this case, we don't want to abort
@@ -127,6 +155,20 @@ class HostSerialManager(SerialManager):
             log.exception("Encountered SerialException while trying to connect") # Traceback logged automatically
         
     
+    def _set_low_latency(self):
+        """
+        [Internal] Requests low latency mode from the serial driver, if supported, so that received bytes are passed
+        on immediately rather than being held back in the driver's buffer. This is currently only supported by
+        pyserial on Linux (ASYNC_LOW_LATENCY); on other platforms this method does nothing.
+        """
+        if not hasattr(self.serial_connection, "set_low_latency_mode"): return
+        try:
+            self.serial_connection.set_low_latency_mode(True) # type: ignore
+            log.debug("Enabled low latency mode")
+        except (OSError, ValueError): # Not all drivers support the ioctl
+            log.debug("Low latency mode not supported by serial driver")
+
+
     def _device_search(self):
         """
         [Internal] Searches available serial ports for volume knob devices and attempts to connect.
@@ -239,6 +281,7 @@ class HostSerialManager(SerialManager):
         # I had assumed that flush() clears both buffers - turns out it does neither! It simply waits until
         # the output buffer is empty. See https://stackoverflow.com/questions/61596242/pyserial-when-should-i-use-flush
         self.serial_connection.reset_input_buffer()
+        self.rx_pending = b""
         return self
     
 
@@ -249,6 +292,7 @@ class HostSerialManager(SerialManager):
             return
         
         try:
+            self.flush() # Write out anything still queued
             self.serial_connection.flush()
             time.sleep(0.5) # Give any remaining messages time to send (flush often doesn't work properly)
         except SerialException: # Plug was pulled or device errored so we can't do anything
@@ -260,16 +304,27 @@ class HostSerialManager(SerialManager):
     ### Method Implementations ###
 
     def send(self, msg: msp.Message):
+        # Messages are queued rather than written straight away, since each write() is a separate USB transfer
+        if not self.serial_connection: return
+        if type(msg) not in MESSAGE_LOG_BLACKLIST and log.getLogger().isEnabledFor(log.DEBUG):
+            log.debug("Sending %s (raw bytes: %s)", type(msg), self._format_bytes(msg.encode()))
+        self.send_queue.append(msg)
+
+    def flush(self):
+        """
+        Writes all queued outgoing messages to the serial connection in a single write call. This should be called
+        once per main loop cycle, after everything for that cycle has been sent.
+        """
+        if not self.send_queue: return
+        # Clear the queue first so a failed write doesn't leave stale messages to be resent after reconnecting
+        msgs, self.send_queue = self.send_queue, []
         if not self.serial_connection: return
-        raw = msg.encode()
-        if type(msg) not in MESSAGE_LOG_BLACKLIST:
-            log.debug("Sending %s (raw bytes: %s)", type(msg), self._format_bytes(raw))
-        self.serial_connection.write(raw)
-
-    def read(self, n: int):
-        if not self.serial_connection: return None
-        log.log(TRACE, "Attempting to read %i bytes", n)
-        return self.serial_connection.read(n)
+        self.serial_connection.write(msp.encode_batch(msgs))
+
+    def readinto(self, buf) -> int:
+        if not self.serial_connection: return 0
+        log.log(TRACE, "Attempting to read %i bytes", len(buf))
+        return self.serial_connection.readinto(buf) or 0
     
     def bytes_waiting(self) -> bool:
         if not self.serial_connection: return False
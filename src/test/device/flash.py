@@ -0,0 +1,35 @@
+import utime
+from machine import Pin
+import led_ring
+
+PIXEL_DATA_PIN = 28
+
+PIXEL_COUNT = 24
+PIXEL_OFFSET = 20
+
+FLASH_COLOUR = (90, 255, 255)
+FLASH_DURATION = 500
+TIMEOUT = 2000 # Generous upper limit on how long the transition should take to finish
+
+led_pin = Pin(25, Pin.OUT)
+led_pin.high()
+
+ring = led_ring.LedRing(PIXEL_DATA_PIN, PIXEL_COUNT, PIXEL_OFFSET)
+
+# Flashing the colour the ring is already showing leaves set_colour() with nothing to change, so the flash itself has
+# to make sure update() keeps running until the transition is over
+ring.set_colour(FLASH_COLOUR)
+ring.update()
+ring.flash(FLASH_COLOUR, FLASH_DURATION)
+
+start = utime.ticks_ms()
+while ring.is_transition_active() and utime.ticks_diff(utime.ticks_ms(), start) < TIMEOUT:
+    ring.update()
+    utime.sleep_ms(10)
+
+assert not ring.is_transition_active(), "Flash of the current colour never finished"
+assert not ring.dirty, "Ring still dirty after the flash finished"
+print("Flash finished after {} ms".format(utime.ticks_diff(utime.ticks_ms(), start)))
+
+ring.release()
+led_pin.low()
\ No newline at end of file